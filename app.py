@@ -1,87 +1,408 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, has_app_context, Response, stream_with_context, send_file
+import click
 import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import execute_values, Json
+import xlsxwriter
+from PIL import Image, ImageOps
 import os
+import io
+import codecs
+import base64
+import binascii
+import json
+import queue
+import select
+import sys
+import csv
+import re
+import html
+import gzip
+import hashlib
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
 from datetime import datetime, timedelta, date
+from decimal import Decimal
 
 app = Flask(__name__)
 app.secret_key = "segredo_super_secreto"
 
 # --- CONEXÃO COM BANCO DE DADOS ---
+# Cada worker do gunicorn mantém o seu próprio pool (criado no primeiro uso, depois do fork).
+# Cada requisição pega UMA conexão do pool e ela é devolvida no teardown, mesmo se a rota der erro.
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))          # segundos esperando conexão livre
+DB_POOL_HEALTHCHECK = float(os.environ.get("DB_POOL_HEALTHCHECK", 30))  # segundos ociosa antes de testar com SELECT 1
+DB_MIGRAR_NA_INICIALIZACAO = os.environ.get("DB_MIGRAR_NA_INICIALIZACAO", "1") != "0"
+
+class PoolConexoes:
+    def __init__(self, minconn, maxconn, timeout, healthcheck, **dsn):
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **dsn)
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        self._healthcheck = healthcheck
+        self._ultimo_uso = {}
+        self._lock = threading.Lock()
+        self.maxconn = maxconn
+        self.stats = {'checkouts': 0, 'em_uso': 0, 'timeouts': 0, 'reconexoes': 0,
+                      'espera_total_ms': 0.0, 'espera_max_ms': 0.0}
+
+    def obter(self):
+        inicio = time.perf_counter()
+        if not self._vagas.acquire(timeout=self._timeout):
+            with self._lock: self.stats['timeouts'] += 1
+            raise pg_pool.PoolError("Tempo esgotado aguardando conexão livre no pool")
+        try:
+            conn = self._validar(self._pool.getconn())
+        except Exception:
+            self._vagas.release()
+            raise
+        espera = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self.stats['checkouts'] += 1
+            self.stats['em_uso'] += 1
+            self.stats['espera_total_ms'] += espera
+            self.stats['espera_max_ms'] = max(self.stats['espera_max_ms'], espera)
+        return conn
+
+    def _validar(self, conn):
+        # Conexão usada há pouco: confia. Ociosa há muito tempo: testa antes de entregar.
+        if not conn.closed and time.monotonic() - self._ultimo_uso.get(id(conn), 0) < self._healthcheck:
+            return conn
+        if not conn.closed:
+            try:
+                with conn.cursor() as cur: cur.execute("SELECT 1")
+                conn.rollback()
+                return conn
+            except psycopg2.Error: pass
+        # Conexão morta (restart do Postgres, timeout do proxy...): descarta e abre outra
+        self._ultimo_uso.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+        with self._lock: self.stats['reconexoes'] += 1
+        return self._pool.getconn()
+
+    def devolver(self, conn):
+        try:
+            descartar = bool(conn.closed)
+            if not descartar and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                try: conn.rollback()  # rota que não deu commit (ou deu erro no meio)
+                except psycopg2.Error: descartar = True
+            if descartar: self._ultimo_uso.pop(id(conn), None)
+            else: self._ultimo_uso[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=descartar)
+        finally:
+            with self._lock: self.stats['em_uso'] -= 1
+            self._vagas.release()
+
+    def resumo(self):
+        with self._lock: s = dict(self.stats)
+        s['espera_media_ms'] = round(s['espera_total_ms'] / s['checkouts'], 3) if s['checkouts'] else 0.0
+        s['max'] = self.maxconn
+        return s
+
+def _dsn():
+    return dict(host=os.environ["DB_HOST"], database=os.environ["DB_NAME"], user=os.environ["DB_USER"],
+                password=os.environ["DB_PASS"], port=os.environ["DB_PORT"])
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid
+    if not os.environ.get("DB_HOST"): return None
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                if DB_MIGRAR_NA_INICIALIZACAO: verificar_migracoes()
+                _pool = PoolConexoes(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK,
+                                     cursor_factory=CursorCronometrado, **_dsn())
+                _pool_pid = os.getpid()
+    return _pool
+
 def get_db_connection():
+    if 'db_conn' in g: return g.db_conn
     try:
-        if os.environ.get("DB_HOST"):
-            return psycopg2.connect(
-                host=os.environ["DB_HOST"],
-                database=os.environ["DB_NAME"],
-                user=os.environ["DB_USER"],
-                password=os.environ["DB_PASS"],
-                port=os.environ["DB_PORT"]
-            )
-        return None 
+        pool = get_pool()
+        if pool is None: return None
+        inicio = time.perf_counter()
+        g.db_conn = pool.obter()
+        g.db_espera = time.perf_counter() - inicio
+        HIST_ESPERA_CONEXAO.observar(g.db_espera)
+        return g.db_conn
     except Exception as e:
-        print(f"Erro DB: {e}")
+        CONT_ERROS_CONEXAO.incrementar(type(e).__name__)
+        app.logger.error("Erro DB: %s", e)
         return None
 
+@app.teardown_appcontext
+def devolver_conexao(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None: get_pool().devolver(conn)
+
+@app.route('/api/pool_stats')
+def pool_stats():
+    if not session.get('logged_in'): return jsonify({}), 403
+    pool = get_pool()
+    return jsonify(pool.resumo() if pool else {})
+
 # ==========================================
-# ROTA DE REPARO GERAL (Salva-Vidas)
+# MÉTRICAS DE DESEMPENHO
 # ==========================================
-@app.route('/reparar_banco')
-def reparar_banco():
-    if not session.get('logged_in'): return redirect(url_for('login'))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    log = []
+# Latência por rota, quantidade/tempo de SQL por requisição e espera por conexão do pool.
+# Expostas em /metrics (formato Prometheus) e no cabeçalho Server-Timing de cada resposta.
+# Os números são do processo: toda série leva o rótulo worker (pid), então cada uma só cresce e o
+# total sai de sum without (worker) (...) no Prometheus, seja qual for o worker que atendeu o scrape.
+DB_CONSULTA_LENTA_MS = float(os.environ.get("DB_CONSULTA_LENTA_MS", 200))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+_metricas_lock = threading.Lock()
+_metricas = []
+
+def _rotulos(nomes=(), valores=()):
+    escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{n}="{escapar(v)}"' for n, v in zip(('worker',) + nomes, (os.getpid(),) + valores)) + '}'
+
+class Contador:
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, rotulos
+        self._series = {}
+        _metricas.append(self)
+
+    def incrementar(self, *valores, qtd=1):
+        with _metricas_lock: self._series[valores] = self._series.get(valores, 0) + qtd
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with _metricas_lock: series = list(self._series.items())
+        linhas += [f"{self.nome}{_rotulos(self.rotulos, v)} {qtd}" for v, qtd in series]
+        return linhas
+
+class Histograma:
+    def __init__(self, nome, ajuda, limites, rotulos=()):
+        self.nome, self.ajuda, self.limites, self.rotulos = nome, ajuda, limites, rotulos
+        self._series = {}  # valores dos rótulos -> [contagem por faixa..., soma, total]
+        _metricas.append(self)
+
+    def observar(self, valor, *valores):
+        with _metricas_lock:
+            serie = self._series.setdefault(valores, [0] * len(self.limites) + [0.0, 0])
+            for i, limite in enumerate(self.limites):
+                if valor <= limite: serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with _metricas_lock: series = [(v, list(s)) for v, s in self._series.items()]
+        for valores, serie in series:
+            for limite, qtd in zip(self.limites, serie):
+                linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos + ('le',), valores + (limite,))} {qtd}")
+            linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos + ('le',), valores + ('+Inf',))} {serie[-1]}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, valores)} {serie[-2]:.6f}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, valores)} {serie[-1]}")
+        return linhas
+
+FAIXAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HIST_REQUISICAO = Histograma('fisio_http_requisicao_segundos', 'Latência das requisições por rota.', FAIXAS_SEGUNDOS, ('rota', 'metodo'))
+CONT_REQUISICOES = Contador('fisio_http_requisicoes_total', 'Requisições atendidas por rota e status.', ('rota', 'metodo', 'status'))
+HIST_SQL_REQUISICAO = Histograma('fisio_sql_por_requisicao_segundos', 'Tempo total de SQL gasto em cada requisição.', FAIXAS_SEGUNDOS, ('rota',))
+HIST_CONSULTAS_REQUISICAO = Histograma('fisio_sql_consultas_por_requisicao', 'Quantidade de consultas SQL por requisição.', (1, 2, 3, 5, 10, 25, 50, 100), ('rota',))
+HIST_CONSULTA = Histograma('fisio_sql_consulta_segundos', 'Duração de cada consulta SQL.', FAIXAS_SEGUNDOS)
+CONT_CONSULTAS_LENTAS = Contador('fisio_sql_consultas_lentas_total', f'Consultas acima de DB_CONSULTA_LENTA_MS ({DB_CONSULTA_LENTA_MS:g} ms).', ('rota',))
+HIST_ESPERA_CONEXAO = Histograma('fisio_db_espera_conexao_segundos', 'Tempo para obter conexão do pool.', (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+CONT_ERROS_CONEXAO = Contador('fisio_db_erros_conexao_total', 'Falhas ao obter conexão do pool.', ('erro',))
+
+def _rota_atual():
+    return request.url_rule.rule if request and request.url_rule else 'nao_encontrada'
+
+def _sql_redigido(query):
+    # Literais inline (execute_values, mogrify) somem do log: nome, CPF e texto clínico não vão para o log
+    if isinstance(query, bytes): query = query.decode('utf-8', 'replace')
+    query = re.sub(r"'(?:[^']|'')*'", "'?'", str(query))
+    return ' '.join(query.split())[:1000]
+
+def _parametros_redigidos(params):
+    if params is None: return '-'
+    if isinstance(params, dict): return '{' + ', '.join(f'{k}: {type(v).__name__}' for k, v in params.items()) + '}'
+    return '(' + ', '.join(type(v).__name__ for v in params) + ')'
+
+def _registrar_consulta(query, params, duracao):
+    HIST_CONSULTA.observar(duracao)
+    rota = '-'
+    if has_app_context() and 'sql_qtd' in g:
+        g.sql_qtd += 1
+        g.sql_tempo += duracao
+        rota = _rota_atual()
+    if duracao * 1000 >= DB_CONSULTA_LENTA_MS:
+        CONT_CONSULTAS_LENTAS.incrementar(rota)
+        app.logger.warning("Consulta lenta (%.0f ms) em %s: %s | parâmetros: %s",
+                           duracao * 1000, rota, _sql_redigido(query), _parametros_redigidos(params))
+
+class CursorCronometrado(psycopg2.extensions.cursor):
+    # cursor_factory do pool: toda consulta das rotas passa por aqui
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try: return super().execute(query, vars)
+        finally: _registrar_consulta(query, vars, time.perf_counter() - inicio)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try: return super().executemany(query, vars_list)
+        finally: _registrar_consulta(query, None, time.perf_counter() - inicio)
+
+@app.before_request
+def iniciar_medicao():
+    g.req_inicio = time.perf_counter()
+    g.sql_qtd = 0
+    g.sql_tempo = 0.0
+
+@app.after_request
+def registrar_medicao(resposta):
+    if 'req_inicio' not in g: return resposta
+    total = time.perf_counter() - g.req_inicio
+    rota = _rota_atual()
+    HIST_REQUISICAO.observar(total, rota, request.method)
+    CONT_REQUISICOES.incrementar(rota, request.method, resposta.status_code)
+    HIST_SQL_REQUISICAO.observar(g.sql_tempo, rota)
+    HIST_CONSULTAS_REQUISICAO.observar(g.sql_qtd, rota)
+    tempos = [f'app;dur={total * 1000:.1f}', f'db;dur={g.sql_tempo * 1000:.1f};desc="{g.sql_qtd} consulta(s)"']
+    if 'db_espera' in g: tempos.append(f'conexao;dur={g.db_espera * 1000:.1f}')
+    resposta.headers['Server-Timing'] = ', '.join(tempos)
+    return resposta
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus manda "Authorization: Bearer <METRICS_TOKEN>"; no navegador basta estar logado
+    token_ok = METRICS_TOKEN and request.headers.get('Authorization') == f'Bearer {METRICS_TOKEN}'
+    if not (token_ok or session.get('logged_in')): return 'Não autorizado\n', 403
+    linhas = []
+    for metrica in _metricas: linhas += metrica.exportar()
+    pool = get_pool() if _pool is not None else None
+    if pool:
+        resumo = pool.resumo()
+        for chave, tipo, ajuda in (('em_uso', 'gauge', 'Conexões emprestadas agora.'), ('max', 'gauge', 'Tamanho máximo do pool.'),
+                                   ('checkouts', 'counter', 'Conexões entregues pelo pool.'), ('timeouts', 'counter', 'Esperas por conexão que estouraram DB_POOL_TIMEOUT.'),
+                                   ('reconexoes', 'counter', 'Conexões mortas descartadas e reabertas.')):
+            nome = f'fisio_db_pool_{chave}' + ('_total' if tipo == 'counter' else '')
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}", f"{nome}{_rotulos()} {resumo[chave]}"]
+    return '\n'.join(linhas) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# ==========================================
+# MIGRAÇÕES DO BANCO
+# ==========================================
+# Arquivos migrations/NNNN_nome.sql aplicados em ordem e registrados em schema_migracoes.
+# Cada arquivo roda numa transação; os marcados com "-- migracao: sem-transacao" (CREATE INDEX
+# CONCURRENTLY) rodam comando a comando em autocommit. Um advisory lock garante que só um
+# processo migra por vez: na inicialização, o worker que não consegue a trava segue sem migrar;
+# o "flask migrar" (passo de deploy) espera a vez.
+PASTA_MIGRACOES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+TRAVA_MIGRACOES = 72400001
+
+def _listar_migracoes():
+    migracoes = []
+    for arquivo in sorted(os.listdir(PASTA_MIGRACOES)):
+        m = re.match(r'(\d+)_(\w+)\.sql$', arquivo)
+        if not m: continue
+        with open(os.path.join(PASTA_MIGRACOES, arquivo), encoding='utf-8') as f: sql = f.read()
+        migracoes.append({'versao': int(m.group(1)), 'nome': m.group(2), 'sql': sql,
+                          'checksum': hashlib.sha256(sql.encode()).hexdigest(),
+                          'sem_transacao': '-- migracao: sem-transacao' in sql})
+    return migracoes
+
+def _comandos(sql):
+    # Só para arquivos sem transação, que têm apenas comandos simples (sem corpo $$ ... $$)
+    return [c.strip() for c in re.sub(r'--[^\n]*', '', sql).split(';') if c.strip()]
+
+def _migracoes_aplicadas(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS schema_migracoes (
+        versao INTEGER PRIMARY KEY, nome TEXT NOT NULL, checksum TEXT NOT NULL,
+        aplicada_em TIMESTAMP DEFAULT NOW(), duracao_ms INTEGER);''')
+    cur.execute("SELECT versao, checksum FROM schema_migracoes")
+    return dict(cur.fetchall())
+
+def _descartar_indices_invalidos(cur, sql):
+    # CREATE INDEX CONCURRENTLY interrompido deixa um índice inválido que o IF NOT EXISTS pularia
+    cur.execute("""SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                   WHERE NOT i.indisvalid AND c.relnamespace = current_schema()::regnamespace""")
+    for (indice,) in cur.fetchall():
+        if re.search(rf'\b{re.escape(indice)}\b', sql): cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{indice}"')
+
+def _registrar_migracao(cur, m, inicio):
+    cur.execute("INSERT INTO schema_migracoes (versao, nome, checksum, duracao_ms) VALUES (%s, %s, %s, %s)",
+                (m['versao'], m['nome'], m['checksum'], int((time.perf_counter() - inicio) * 1000)))
+
+def aplicar_migracoes(conn, log=print, esperar=True):
+    conn.autocommit = True
+    cur = conn.cursor()
+    # pg_try_advisory_lock em laço, nunca pg_advisory_lock: a sessão bloqueada no lock segura um snapshot,
+    # o CREATE INDEX CONCURRENTLY de quem está migrando espera por ele e os dois terminam em deadlock
+    while True:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (TRAVA_MIGRACOES,))
+        if cur.fetchone()[0]: break
+        if not esperar:
+            conn.autocommit = False
+            return None
+        time.sleep(1)
     try:
-        # 1. Tabela Financeiro
-        cursor.execute('''CREATE TABLE IF NOT EXISTS financeiro (
-            id SERIAL PRIMARY KEY,
-            descricao TEXT NOT NULL,
-            valor NUMERIC(10, 2) NOT NULL,
-            tipo VARCHAR(10) NOT NULL,
-            categoria TEXT,
-            data DATE DEFAULT CURRENT_DATE
-        );''')
-        log.append("Tabela Financeiro: OK")
-
-        # 2. Tabela Evoluções
-        cursor.execute('''CREATE TABLE IF NOT EXISTS evolucoes (
-            id SERIAL PRIMARY KEY, paciente_id INTEGER REFERENCES pacientes(id) ON DELETE CASCADE,
-            data TIMESTAMP DEFAULT CURRENT_TIMESTAMP, texto TEXT);''')
-        log.append("Tabela Evoluções: OK")
-
-        # 3. Tabela Avaliação Completa
-        cursor.execute('''CREATE TABLE IF NOT EXISTS avaliacoes_completa (
-            id SERIAL PRIMARY KEY, paciente_id INTEGER REFERENCES pacientes(id) ON DELETE CASCADE,
-            data_avaliacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            ocupacao TEXT, lateralidade TEXT, diagnostico_medico TEXT, queixa_principal TEXT,
-            hma TEXT, hpp TEXT, habitos TEXT, sinais_vitais TEXT, avaliacao_dor TEXT,
-            inspecao TEXT, palpacao TEXT, adm TEXT, forca_muscular TEXT, neuro TEXT,
-            testes_especiais TEXT, diagnostico_cif TEXT, objetivos TEXT, conduta TEXT);''')
-        
-        # 4. Atualização de Colunas Extras (Pilates, Quiro, Cardio)
-        cursor.execute("ALTER TABLE avaliacoes_completa ADD COLUMN IF NOT EXISTS dados_pilates TEXT;")
-        cursor.execute("ALTER TABLE avaliacoes_completa ADD COLUMN IF NOT EXISTS dados_quiro TEXT;")
-        cursor.execute("ALTER TABLE avaliacoes_completa ADD COLUMN IF NOT EXISTS dados_cardio TEXT;") 
-        log.append("Colunas Extras Avaliação: OK")
-
-        # 5. Tabela Fotos
-        cursor.execute('''CREATE TABLE IF NOT EXISTS avaliacao_postural (
-            id SERIAL PRIMARY KEY, paciente_id INTEGER REFERENCES pacientes(id) ON DELETE CASCADE,
-            data_foto TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            foto_frontal TEXT, foto_posterior TEXT, foto_lat_dir TEXT, foto_lat_esq TEXT,
-            analise_ia TEXT);''')
-        log.append("Tabela Fotos: OK")
-
-        # 6. Status na Agenda
-        try:
-            cursor.execute("ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'Agendado';")
-        except: pass
+        aplicadas = _migracoes_aplicadas(cur)
+        pendentes = []
+        for m in _listar_migracoes():
+            if m['versao'] not in aplicadas: pendentes.append(m)
+            elif aplicadas[m['versao']] != m['checksum']:
+                log(f"AVISO: {m['versao']:04d}_{m['nome']} foi alterada depois de aplicada")
+        for m in pendentes:
+            inicio = time.perf_counter()
+            if m['sem_transacao']:
+                _descartar_indices_invalidos(cur, m['sql'])
+                for comando in _comandos(m['sql']): cur.execute(comando)
+                _registrar_migracao(cur, m, inicio)
+            else:
+                conn.autocommit = False
+                try:
+                    cur.execute(m['sql'])
+                    _registrar_migracao(cur, m, inicio)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+            log(f"{m['versao']:04d}_{m['nome']}: OK ({(time.perf_counter() - inicio) * 1000:.0f} ms)")
+        return len(pendentes)
+    finally:
+        if not conn.closed: cur.execute("SELECT pg_advisory_unlock(%s)", (TRAVA_MIGRACOES,))
+        conn.autocommit = False
 
-        conn.commit()
-        return jsonify({'status': 'Sucesso', 'log': log})
+def verificar_migracoes():
+    # Chamada ao criar o pool de cada processo; falha aqui vai para o log de erro, não passa em silêncio
+    try:
+        conn = psycopg2.connect(**_dsn())
+        try: total = aplicar_migracoes(conn, log=lambda msg: app.logger.warning("Migrações: %s", msg), esperar=False)
+        finally: conn.close()
+        if total is None: app.logger.warning("Migrações: outro processo está migrando; este worker segue sem esperar")
     except Exception as e:
-        conn.rollback()
-        return jsonify({'status': 'Erro Crítico', 'erro': str(e)})
+        app.logger.error("Erro nas migrações: %s", e)
+
+@app.cli.command('migrar')
+@click.option('--status', is_flag=True, help='Só lista as migrações, sem aplicar nada.')
+def migrar_cmd(status):
+    """Aplica as migrações pendentes da pasta migrations/."""
+    conn = psycopg2.connect(**_dsn())
+    try:
+        if status:
+            conn.autocommit = True
+            aplicadas = _migracoes_aplicadas(conn.cursor())
+            for m in _listar_migracoes():
+                situacao = 'pendente' if m['versao'] not in aplicadas else 'ALTERADA' if aplicadas[m['versao']] != m['checksum'] else 'aplicada'
+                print(f"{m['versao']:04d}_{m['nome']}: {situacao}")
+            return
+        total = aplicar_migracoes(conn)
+        print(f"{total} migração(ões) aplicada(s)." if total else "Banco já está na última versão.")
     finally:
         conn.close()
 
@@ -111,117 +432,114 @@ def dashboard():
     cursor = conn.cursor()
     cursor.execute("SELECT COUNT(*) FROM pacientes;")
     total_pacientes = cursor.fetchone()[0]
-    conn.close()
     return render_template('dashboard.html', total_pacientes=total_pacientes)
 
 @app.route('/pacientes', methods=['GET', 'POST'])
 def pacientes():
     if not session.get('logged_in'): return redirect(url_for('login'))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     if request.method == 'POST':
+        conn = get_db_connection()
+        cursor = conn.cursor()
         nome = request.form['nome']
         dt = request.form.get('data_nascimento') or None
         tel = request.form.get('telefone')
         cursor.execute("INSERT INTO pacientes (nome, data_nascimento, telefone) VALUES (%s, %s, %s)", (nome, dt, tel))
         conn.commit()
-        conn.close()
         return redirect(url_for('pacientes')) 
     
-    cursor.execute("SELECT id, nome, data_nascimento, telefone FROM pacientes ORDER BY id DESC")
-    dados = cursor.fetchall()
-    
-    lista = []
-    hoje = date.today()
-    for p in dados:
-        idade = "---"
-        if p[2]:
-            try: idade = f"{hoje.year - p[2].year - ((hoje.month, hoje.day) < (p[2].month, p[2].day))} anos"
-            except: pass
-        lista.append((p[0], p[1], idade, p[3]))
-        
-    conn.close()
-    return render_template('pacientes.html', pacientes=lista)
+    # A lista é carregada sob demanda por /api/pacientes/buscar
+    return render_template('pacientes.html')
 
 @app.route('/agenda')
 def agenda():
     if not session.get('logged_in'): return redirect(url_for('login'))
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, nome FROM pacientes ORDER BY nome ASC")
-    pacientes = cur.fetchall()
-    conn.close()
-    return render_template('agenda.html', pacientes=pacientes)
+    return render_template('agenda.html')
 
 @app.route('/prontuarios')
 def prontuarios():
     if not session.get('logged_in'): return redirect(url_for('login'))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, nome, data_nascimento FROM pacientes ORDER BY nome ASC")
-    pacientes = cursor.fetchall()
-    conn.close()
-    return render_template('prontuarios.html', pacientes=pacientes)
+    return render_template('prontuarios.html')
 
 @app.route('/financeiro')
 def financeiro():
     if not session.get('logged_in'): return redirect(url_for('login'))
     return render_template('financeiro.html')
 
+# ==========================================
+# RESUMOS MENSAIS (ROLLUPS DO DASHBOARD)
+# ==========================================
+# Uma linha por (mês, paciente, status) e por (mês, tipo), mantidas por triggers nas tabelas de origem
+# (migrations/0003_resumos_mensais.sql). Aqui só a reconstrução completa, para o comando abaixo.
+def _reconstruir_resumos(cur):
+    # Trava escrita nas tabelas de origem enquanto recalcula, para nenhum +1/-1 se perder
+    cur.execute("LOCK TABLE agendamentos, financeiro IN SHARE MODE")
+    cur.execute("TRUNCATE resumo_mensal_sessoes, resumo_mensal_financeiro")
+    cur.execute("""
+        INSERT INTO resumo_mensal_sessoes (mes, status, paciente_id, qtd)
+        SELECT date_trunc('month', start_time)::date, COALESCE(status, 'Agendado'), paciente_id, COUNT(*)
+        FROM agendamentos GROUP BY 1, 2, 3
+    """)
+    cur.execute("""
+        INSERT INTO resumo_mensal_financeiro (mes, tipo, total, qtd)
+        SELECT date_trunc('month', data)::date, tipo, SUM(valor), COUNT(*) FROM financeiro GROUP BY 1, 2
+    """)
+
+@app.cli.command('reconstruir-resumos')
+def reconstruir_resumos_cmd():
+    """Recalcula do zero os resumos mensais do dashboard."""
+    conn = get_db_connection()
+    _reconstruir_resumos(conn.cursor())
+    conn.commit()
+    print("Resumos mensais reconstruídos.")
+
 # ==========================================
 # API INTELIGENTE DO DASHBOARD
 # ==========================================
 @app.route('/api/dados_dashboard')
 def dados_dashboard():
     if not session.get('logged_in'): return jsonify({}), 403
+    hoje = datetime.now()
+    try:
+        mes, ano = int(request.args.get('mes', hoje.month)), int(request.args.get('ano', hoje.year))
+        if not 1 <= mes <= 12: raise ValueError(f"mês {mes} fora de 1 a 12")
+        if not 1900 <= ano <= 2100: raise ValueError(f"ano {ano} fora de 1900 a 2100")
+        ref = date(ano, mes, 1)
+    except ValueError as e: return jsonify({'status': 'error', 'msg': f'Período inválido: {e}'}), 400
     conn = get_db_connection()
     cur = conn.cursor()
-    
-    mes = request.args.get('mes', datetime.now().month, type=int)
-    ano = request.args.get('ano', datetime.now().year, type=int)
 
     # 1. Sessões por Paciente
     cur.execute("""
-        SELECT p.nome, COUNT(a.id) FROM agendamentos a 
-        JOIN pacientes p ON a.paciente_id = p.id 
-        WHERE a.status = 'Realizado' AND EXTRACT(MONTH FROM a.start_time) = %s AND EXTRACT(YEAR FROM a.start_time) = %s 
-        GROUP BY p.nome ORDER BY COUNT(a.id) DESC LIMIT 10
-    """, (mes, ano))
+        SELECT p.nome, r.qtd FROM resumo_mensal_sessoes r
+        JOIN pacientes p ON r.paciente_id = p.id
+        WHERE r.mes = %s AND r.status = 'Realizado'
+        ORDER BY r.qtd DESC LIMIT 10
+    """, (ref,))
     raw_sessoes = cur.fetchall()
     
     # 2. Status
-    cur.execute("""
-        SELECT COALESCE(status, 'Agendado'), COUNT(*) FROM agendamentos 
-        WHERE EXTRACT(MONTH FROM start_time) = %s AND EXTRACT(YEAR FROM start_time) = %s GROUP BY 1
-    """, (mes, ano))
-    raw_status = dict(cur.fetchall())
+    cur.execute("SELECT status, SUM(qtd) FROM resumo_mensal_sessoes WHERE mes = %s GROUP BY 1", (ref,))
+    raw_status = {k: int(v) for k, v in cur.fetchall()}
 
     # 3. Financeiro (6 meses)
     cur.execute("""
-        SELECT TO_CHAR(data, 'MM/YYYY'), tipo, SUM(valor) FROM financeiro 
-        WHERE data >= CURRENT_DATE - INTERVAL '5 months' GROUP BY 1, 2 ORDER BY MAX(data) ASC
+        SELECT TO_CHAR(mes, 'MM/YYYY'),
+               COALESCE(SUM(total) FILTER (WHERE tipo = 'entrada'), 0),
+               COALESCE(SUM(total) FILTER (WHERE tipo = 'saida'), 0)
+        FROM resumo_mensal_financeiro
+        WHERE mes >= date_trunc('month', CURRENT_DATE - INTERVAL '5 months') GROUP BY mes ORDER BY mes ASC
     """)
     raw_fin = cur.fetchall()
 
-    fin_labels, fin_entradas, fin_saidas, temp_fin = [], [], [], {}
-    for data_str, tipo, valor in raw_fin:
-        if data_str not in temp_fin: temp_fin[data_str] = {'entrada': 0, 'saida': 0}
-        temp_fin[data_str][tipo] = float(valor)
-    for m in temp_fin:
-        fin_labels.append(m)
-        fin_entradas.append(temp_fin[m]['entrada'])
-        fin_saidas.append(temp_fin[m]['saida'])
-
     # 4. Totais
-    cur.execute("SELECT SUM(valor) FROM financeiro WHERE tipo='entrada' AND EXTRACT(MONTH FROM data)=%s AND EXTRACT(YEAR FROM data)=%s", (mes, ano))
-    faturamento = cur.fetchone()[0] or 0
+    cur.execute("SELECT total FROM resumo_mensal_financeiro WHERE tipo = 'entrada' AND mes = %s", (ref,))
+    row = cur.fetchone()
+    faturamento = row[0] if row else 0
 
-    conn.close()
     return jsonify({
         'sessoes_paciente': {'nomes': [r[0] for r in raw_sessoes], 'qtd': [r[1] for r in raw_sessoes]},
         'status_agendamentos': {'labels': list(raw_status.keys()), 'values': list(raw_status.values())},
-        'financeiro': {'labels': fin_labels, 'entradas': fin_entradas, 'saidas': fin_saidas},
+        'financeiro': {'labels': [r[0] for r in raw_fin], 'entradas': [float(r[1]) for r in raw_fin], 'saidas': [float(r[2]) for r in raw_fin]},
         'resumo_mes': {'faturamento': float(faturamento), 'realizadas': int(raw_status.get('Realizado', 0))}
     })
 
@@ -234,22 +552,108 @@ def financeiro_resumo():
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT SUM(valor) FROM financeiro WHERE tipo = 'entrada'")
-        entradas = cur.fetchone()[0] or 0
-        cur.execute("SELECT SUM(valor) FROM financeiro WHERE tipo = 'saida'")
-        saidas = cur.fetchone()[0] or 0
+        cur.execute("""SELECT COALESCE(SUM(total) FILTER (WHERE tipo = 'entrada'), 0), COALESCE(SUM(total) FILTER (WHERE tipo = 'saida'), 0)
+                       FROM resumo_mensal_financeiro""")
+        entradas, saidas = cur.fetchone()
         return jsonify({'entradas': float(entradas), 'saidas': float(saidas), 'saldo': float(entradas - saidas)})
     except: return jsonify({'entradas': 0, 'saidas': 0, 'saldo': 0})
-    finally: conn.close()
+
+def _filtro_financeiro():
+    # Período (inicio/fim inclusivos, AAAA-MM-DD), categoria e tipo, comuns à listagem e à exportação
+    where, params = [], []
+    if request.args.get('inicio'): where.append("data >= %s"); params.append(date.fromisoformat(request.args['inicio']))
+    if request.args.get('fim'): where.append("data <= %s"); params.append(date.fromisoformat(request.args['fim']))
+    if request.args.get('categoria'): where.append("categoria = %s"); params.append(request.args['categoria'])
+    if request.args.get('tipo') in ('entrada', 'saida'): where.append("tipo = %s"); params.append(request.args['tipo'])
+    return " AND ".join(where) or "TRUE", params
 
 @app.route('/api/financeiro/listar')
 def financeiro_listar():
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT id, descricao, valor, tipo, categoria, data FROM financeiro ORDER BY data DESC, id DESC LIMIT 50")
-    rows = cur.fetchall()
-    conn.close()
-    return jsonify([{'id':r[0], 'descricao':r[1], 'valor':float(r[2]), 'tipo':r[3], 'categoria':r[4], 'data':r[5].strftime('%d/%m/%Y')} for r in rows])
+    limite = max(1, min(request.args.get('limite', 50, type=int), 200))
+    try:
+        where, params = _filtro_financeiro()
+        filtro, params_antes = _filtro_antes('data', 'date')
+    except ValueError as e: return jsonify({'status': 'error', 'msg': f'Filtro ou cursor inválido (datas AAAA-MM-DD): {e}'}), 400
+    rows, tem_mais = _pagina_keyset(cur, f"SELECT id, descricao, valor, tipo, categoria, data FROM financeiro WHERE {where}{filtro} ORDER BY data DESC, id DESC",
+                                    params + params_antes, limite)
+    return jsonify({
+        'lancamentos': [{'id':r[0], 'descricao':r[1], 'valor':float(r[2]), 'tipo':r[3], 'categoria':r[4], 'data':r[5].strftime('%d/%m/%Y'), 'data_iso':r[5].isoformat()} for r in rows],
+        'proximo': {'antes_data': rows[-1][5].isoformat(), 'antes_id': rows[-1][0]} if tem_mais else None
+    })
+
+# Exportação para a contabilidade: cursor nomeado no servidor (lê itersize linhas por vez) e resposta
+# em gerador, então a memória não cresce com o período exportado.
+COLUNAS_EXPORTACAO = ['Data', 'Descrição', 'Categoria', 'Tipo', 'Valor']
+
+def _linhas_financeiro(where, params):
+    cur = get_db_connection().cursor(name='exportar_financeiro')
+    cur.itersize = 2000
+    try:
+        cur.execute(f"SELECT data, descricao, categoria, tipo, valor FROM financeiro WHERE {where} ORDER BY data, id", params)
+        yield from cur
+    finally:
+        cur.close()
+
+def _exportar_csv(linhas):
+    # Padrão do Excel em português: BOM UTF-8, ponto e vírgula e vírgula decimal
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    escritor.writerow(COLUNAS_EXPORTACAO)
+    for i, (data, descricao, categoria, tipo, valor) in enumerate(linhas, 1):
+        escritor.writerow([data.strftime('%d/%m/%Y'), descricao, categoria, tipo, f"{valor:.2f}".replace('.', ',')])
+        if i % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0); buffer.truncate()
+    yield buffer.getvalue()
+
+def _exportar_xlsx(linhas):
+    # constant_memory grava cada linha no disco ao passar para a próxima; o .xlsx pronto é enviado em blocos
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as arquivo:
+        livro = xlsxwriter.Workbook(arquivo.name, {'constant_memory': True, 'tmpdir': tempfile.gettempdir()})
+        planilha = livro.add_worksheet('Financeiro')
+        negrito = livro.add_format({'bold': True, 'bg_color': '#EEEEEE'})
+        fmt_data = livro.add_format({'num_format': 'dd/mm/yyyy'})
+        fmt_valor = livro.add_format({'num_format': '#,##0.00'})
+        planilha.set_column(0, 0, 12); planilha.set_column(1, 1, 40); planilha.set_column(2, 3, 16); planilha.set_column(4, 4, 14)
+        planilha.write_row(0, 0, COLUNAS_EXPORTACAO, negrito)
+        planilha.freeze_panes(1, 0)
+        linha = 0
+        for linha, (data, descricao, categoria, tipo, valor) in enumerate(linhas, 1):
+            planilha.write_datetime(linha, 0, datetime.combine(data, datetime.min.time()), fmt_data)
+            planilha.write_string(linha, 1, descricao or '')
+            planilha.write_string(linha, 2, categoria or '')
+            planilha.write_string(linha, 3, tipo)
+            planilha.write_number(linha, 4, float(valor), fmt_valor)
+        planilha.autofilter(0, 0, max(linha, 1), len(COLUNAS_EXPORTACAO) - 1)
+        intervalo = f"{{}}2:{{}}{max(linha, 1) + 1}"
+        for deslocamento, (rotulo, formula) in enumerate((
+                ('Total entradas', f'=SUMIF({intervalo.format("D", "D")},"entrada",{intervalo.format("E", "E")})'),
+                ('Total saídas', f'=SUMIF({intervalo.format("D", "D")},"saida",{intervalo.format("E", "E")})'),
+                ('Saldo', f'=E{linha + 3}-E{linha + 4}')), 3):
+            planilha.write_string(linha + deslocamento - 1, 3, rotulo, negrito)
+            planilha.write_formula(linha + deslocamento - 1, 4, formula, fmt_valor)
+        livro.close()
+        while True:
+            bloco = arquivo.read(64 * 1024)
+            if not bloco: break
+            yield bloco
+
+@app.route('/api/financeiro/exportar')
+def financeiro_exportar():
+    if not session.get('logged_in'): return jsonify({}), 403
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'xlsx'): return jsonify({'status': 'error', 'msg': 'Formato deve ser csv ou xlsx'}), 400
+    try: where, params = _filtro_financeiro()
+    except ValueError: return jsonify({'status': 'error', 'msg': 'Datas no formato AAAA-MM-DD'}), 400
+    nome = "financeiro_{}_{}.{}".format(request.args.get('inicio') or 'inicio', request.args.get('fim') or date.today().isoformat(), formato)
+    if formato == 'csv':
+        corpo, mimetype = _exportar_csv(_linhas_financeiro(where, params)), 'text/csv; charset=utf-8'
+    else:
+        corpo, mimetype = _exportar_xlsx(_linhas_financeiro(where, params)), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return Response(stream_with_context(corpo), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{nome}"'})
 
 @app.route('/api/financeiro/salvar', methods=['POST'])
 def financeiro_salvar():
@@ -263,7 +667,6 @@ def financeiro_salvar():
         return jsonify({'status': 'success'})
     except Exception as e:
         return jsonify({'status': 'error', 'msg': str(e)}), 500
-    finally: conn.close()
 
 @app.route('/api/financeiro/deletar', methods=['POST'])
 def financeiro_deletar():
@@ -272,16 +675,45 @@ def financeiro_deletar():
     cur = conn.cursor()
     cur.execute("DELETE FROM financeiro WHERE id = %s", (d['id'],))
     conn.commit()
-    conn.close()
     return jsonify({'status': 'success'})
 
 # ==========================================
 # APIs CLINICAS (AVALIAÇÃO, EVOLUÇÃO, ETC)
 # ==========================================
 
+# Dados do TC6 em colunas numéricas; aparelhos/regiões/técnicas em JSONB indexado (migrations/0006).
+# O texto livre (dados_cardio/pilates/quiro) continua gravado para exibição.
+def _numero(v):
+    try: return float(str(v).replace(',', '.')) if v not in (None, '') else None
+    except ValueError: return None
+
+# Faixas aceitas (as mesmas do backfill da migrations/0006): fora delas é erro de digitação e a coluna
+# NUMERIC estreita estouraria no INSERT, perdendo a avaliação inteira
+FAIXAS_TC6 = {'distancia': (0, 2000), 'paradas': (0, 100), 'o2_litros': (0, 15), 'borg_dispneia': (0, 10), 'borg_mmii': (0, 10)}
+NOMES_TC6 = {'distancia': 'Distância do TC6', 'paradas': 'Paradas', 'o2_litros': 'O2 (L/min)', 'borg_dispneia': 'Borg dispneia', 'borg_mmii': 'Borg MMII'}
+
+def _valores_tc6(tc6):
+    valores = {}
+    for campo, (minimo, maximo) in FAIXAS_TC6.items():
+        v = _numero(tc6.get(campo))
+        if v is not None and not minimo <= v <= maximo:  # NaN também cai aqui
+            raise ValueError(f"{NOMES_TC6[campo]} deve estar entre {minimo} e {maximo}")
+        valores[campo] = v
+    if valores['paradas'] is not None:
+        if valores['paradas'] != int(valores['paradas']): raise ValueError("Paradas deve ser um número inteiro")
+        valores['paradas'] = int(valores['paradas'])
+    return valores
+
+def _lista(v):
+    return [str(x).strip() for x in (v or []) if str(x).strip()]
+
 @app.route('/api/salvar_avaliacao', methods=['POST'])
 def salvar_avaliacao():
     d = request.json
+    tc6 = d.get('tc6') or {}
+    usou_o2 = tc6.get('usou_o2')
+    try: valores_tc6 = _valores_tc6(tc6)
+    except ValueError as e: return jsonify({'status': 'error', 'msg': str(e)}), 400
     conn = get_db_connection()
     cur = conn.cursor()
     try:
@@ -289,53 +721,421 @@ def salvar_avaliacao():
         dados_quiro = d.get('dados_quiro', '')
         dados_cardio = d.get('dados_cardio', '') # Cardio TC6
 
+        # Versão estruturada (o formulário manda os campos separados além do texto)
+        e = d.get('estruturado') or {}
+        cardio, pilates, quiro = e.get('cardio') or {}, e.get('pilates') or {}, e.get('quiro') or {}
+        estruturado = {
+            'cardio': {'sinais': cardio.get('sinais') or None, 'mrc': cardio.get('mrc') or None,
+                       'espirometria': cardio.get('espirometria') or None, 'equipamentos': _lista(cardio.get('equipamentos'))},
+            'pilates': {'aparelhos': _lista(pilates.get('aparelhos'))},
+            'quiro': {'regioes': _lista(quiro.get('regioes')), 'tecnicas': _lista(quiro.get('tecnicas'))}
+        }
+        estruturado['cardio'] = {k: v for k, v in estruturado['cardio'].items() if v is not None}
+
         cur.execute("""
             INSERT INTO avaliacoes_completa 
-            (paciente_id, ocupacao, lateralidade, diagnostico_medico, queixa_principal, hma, hpp, habitos, sinais_vitais, avaliacao_dor, inspecao, palpacao, adm, forca_muscular, neuro, testes_especiais, diagnostico_cif, objetivos, conduta, dados_pilates, dados_quiro, dados_cardio) 
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        """, (d['paciente_id'], d['ocupacao'], d['lateralidade'], d['diagnostico_medico'], d['queixa_principal'], d['hma'], d['hpp'], d['habitos'], d['sinais_vitais'], d['avaliacao_dor'], d['inspecao'], d['palpacao'], d['adm'], d['forca_muscular'], d['neuro'], d['testes_especiais'], d['diagnostico_cif'], d['objetivos'], d['conduta'], dados_pilates, dados_quiro, dados_cardio))
+            (paciente_id, ocupacao, lateralidade, diagnostico_medico, queixa_principal, hma, hpp, habitos, sinais_vitais, avaliacao_dor, inspecao, palpacao, adm, forca_muscular, neuro, testes_especiais, diagnostico_cif, objetivos, conduta, dados_pilates, dados_quiro, dados_cardio,
+             tc6_distancia, tc6_paradas, tc6_usou_o2, tc6_o2_litros, tc6_borg_dispneia, tc6_borg_mmii, dados_estruturados) 
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        """, (d['paciente_id'], d['ocupacao'], d['lateralidade'], d['diagnostico_medico'], d['queixa_principal'], d['hma'], d['hpp'], d['habitos'], d['sinais_vitais'], d['avaliacao_dor'], d['inspecao'], d['palpacao'], d['adm'], d['forca_muscular'], d['neuro'], d['testes_especiais'], d['diagnostico_cif'], d['objetivos'], d['conduta'], dados_pilates, dados_quiro, dados_cardio,
+              valores_tc6['distancia'], valores_tc6['paradas'], None if usou_o2 is None else bool(usou_o2), valores_tc6['o2_litros'] if usou_o2 else None,
+              valores_tc6['borg_dispneia'], valores_tc6['borg_mmii'], Json(estruturado)))
         
         conn.commit()
         return jsonify({'status': 'success'})
     except Exception as e:
         conn.rollback()
         return jsonify({'status': 'error', 'msg': str(e)}), 500
-    finally: conn.close()
+
+CAMPOS_AVALIACAO = ['ocupacao', 'lateralidade', 'diagnostico_medico', 'queixa_principal', 'hma', 'hpp', 'habitos', 'sinais_vitais', 'avaliacao_dor', 'inspecao', 'palpacao', 'adm', 'forca_muscular', 'neuro', 'testes_especiais', 'diagnostico_cif', 'objetivos', 'conduta', 'data_avaliacao', 'dados_pilates', 'dados_quiro', 'dados_cardio', 'id',
+                    'tc6_distancia', 'tc6_paradas', 'tc6_usou_o2', 'tc6_o2_litros', 'tc6_borg_dispneia', 'tc6_borg_mmii', 'dados_estruturados']
+SQL_AVALIACAO = f"SELECT {', '.join(CAMPOS_AVALIACAO)} FROM avaliacoes_completa"
+
+def _avaliacao_json(r):
+    d = dict(zip(CAMPOS_AVALIACAO, r))
+    d['data'] = d.pop('data_avaliacao').strftime("%d/%m/%Y")
+    for extra in ('dados_pilates', 'dados_quiro', 'dados_cardio'): d[extra] = d[extra] or ''
+    tc6 = {k: d.pop('tc6_' + k) for k in ('distancia', 'paradas', 'usou_o2', 'o2_litros', 'borg_dispneia', 'borg_mmii')}
+    d['tc6'] = {k: float(v) if isinstance(v, Decimal) else v for k, v in tc6.items()}
+    d['estruturado'] = d.pop('dados_estruturados') or {}
+    d['encontrado'] = True
+    return d
+
+def _pagina_keyset(cur, sql, params, limite):
+    # Busca limite+1 linhas: se vier a extra, a página seguinte começa depois da última devolvida
+    cur.execute(sql + " LIMIT %s", params + [limite + 1])
+    rows = cur.fetchall()
+    return rows[:limite], len(rows) > limite
+
+def _filtro_antes(coluna_data, tipo='timestamp'):
+    # Cursor (data, id) da última linha já exibida; a ordem é sempre (data DESC, id DESC).
+    # Cursor incompleto ou malformado levanta ValueError: as rotas respondem 400
+    if not request.args.get('antes_id'): return "", []
+    if not request.args.get('antes_data'): raise ValueError("antes_data é obrigatório junto com antes_id")
+    return f" AND ({coluna_data}, id) < (%s::{tipo}, %s)", [datetime.fromisoformat(request.args['antes_data']), int(request.args['antes_id'])]
 
 @app.route('/api/get_avaliacao/<int:pid>', methods=['GET'])
 def get_avaliacao(pid):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT ocupacao, lateralidade, diagnostico_medico, queixa_principal, hma, hpp, habitos, sinais_vitais, avaliacao_dor, inspecao, palpacao, adm, forca_muscular, neuro, testes_especiais, diagnostico_cif, objetivos, conduta, data_avaliacao, dados_pilates, dados_quiro, dados_cardio FROM avaliacoes_completa WHERE paciente_id = %s ORDER BY id DESC LIMIT 1", (pid,))
+        cur.execute(SQL_AVALIACAO + " WHERE paciente_id = %s ORDER BY data_avaliacao DESC, id DESC LIMIT 1", (pid,))
         r = cur.fetchone()
-        if r: 
-            return jsonify({
-                'encontrado': True, 
-                'ocupacao': r[0], 'lateralidade': r[1], 'diagnostico_medico': r[2], 'queixa_principal': r[3], 'hma': r[4], 'hpp': r[5], 'habitos': r[6], 'sinais_vitais': r[7], 'avaliacao_dor': r[8], 'inspecao': r[9], 'palpacao': r[10], 'adm': r[11], 'forca_muscular': r[12], 'neuro': r[13], 'testes_especiais': r[14], 'diagnostico_cif': r[15], 'objetivos': r[16], 'conduta': r[17], 
-                'data': r[18].strftime("%d/%m/%Y"),
-                'dados_pilates': r[19] if len(r) > 19 else '', 
-                'dados_quiro': r[20] if len(r) > 20 else '',
-                'dados_cardio': r[21] if len(r) > 21 else ''
-            })
+        if r: return jsonify(_avaliacao_json(r))
         return jsonify({'encontrado': False})
     except: return jsonify({'encontrado': False})
-    finally: conn.close()
+
+def _pagina_avaliacoes(cur, pid, limite, filtro="", params=()):
+    rows, tem_mais = _pagina_keyset(cur, f"""
+        SELECT id, data_avaliacao, diagnostico_medico, queixa_principal FROM avaliacoes_completa
+        WHERE paciente_id = %s{filtro} ORDER BY data_avaliacao DESC, id DESC
+    """, [pid] + list(params), limite)
+    return {
+        'avaliacoes': [{'id': r[0], 'data': r[1].strftime("%d/%m/%Y"), 'diagnostico_medico': r[2], 'queixa_principal': r[3]} for r in rows],
+        'proximo': {'antes_data': rows[-1][1].isoformat(), 'antes_id': rows[-1][0]} if tem_mais else None
+    }
+
+@app.route('/api/avaliacoes/<int:pid>', methods=['GET'])
+def listar_avaliacoes(pid):
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    limite = max(1, min(request.args.get('limite', 10, type=int), 50))
+    try: filtro, params = _filtro_antes('data_avaliacao')
+    except ValueError as e: return jsonify({'status': 'error', 'msg': f'Cursor de paginação inválido: {e}'}), 400
+    return jsonify(_pagina_avaliacoes(cur, pid, limite, filtro, params))
+
+@app.route('/api/avaliacao/<int:id>', methods=['GET'])
+def get_avaliacao_por_id(id):
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(SQL_AVALIACAO + " WHERE id = %s", (id,))
+    r = cur.fetchone()
+    if r: return jsonify(_avaliacao_json(r))
+    return jsonify({'encontrado': False}), 404
+
+# ==========================================
+# TENDÊNCIAS DE DESFECHO (TC6)
+# ==========================================
+@app.route('/api/tendencias/tc6/<int:pid>')
+def tendencia_tc6_paciente(pid):
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT data_avaliacao, tc6_distancia, tc6_paradas, tc6_usou_o2, tc6_o2_litros, tc6_borg_dispneia, tc6_borg_mmii,
+               tc6_distancia - FIRST_VALUE(tc6_distancia) OVER (ORDER BY data_avaliacao, id)
+        FROM avaliacoes_completa WHERE paciente_id = %s AND tc6_distancia IS NOT NULL
+        ORDER BY data_avaliacao, id
+    """, (pid,))
+    num = lambda v: float(v) if v is not None else None
+    return jsonify([{'data': r[0].strftime('%d/%m/%Y'), 'distancia': num(r[1]), 'paradas': r[2], 'usou_o2': r[3], 'o2_litros': num(r[4]),
+                     'borg_dispneia': num(r[5]), 'borg_mmii': num(r[6]), 'variacao': num(r[7])} for r in cur.fetchall()])
+
+# Filtros de coorte via JSONB (@> usa o índice GIN jsonb_path_ops)
+FILTROS_COORTE = {'aparelho': ('pilates', 'aparelhos'), 'regiao': ('quiro', 'regioes'), 'tecnica': ('quiro', 'tecnicas'), 'equipamento': ('cardio', 'equipamentos')}
+
+@app.route('/api/tendencias/tc6')
+def tendencia_tc6_coorte():
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    fim = datetime.fromisoformat(request.args['fim']) if request.args.get('fim') else datetime.now()
+    inicio = datetime.fromisoformat(request.args['inicio']) if request.args.get('inicio') else fim - timedelta(days=365)
+    where, params = "tc6_distancia IS NOT NULL AND data_avaliacao >= %s AND data_avaliacao < %s", [inicio, fim]
+    for arg, (grupo, chave) in FILTROS_COORTE.items():
+        if request.args.get(arg):
+            where += " AND dados_estruturados @> %s"
+            params.append(Json({grupo: {chave: [request.args[arg]]}}))
+
+    cur.execute(f"""
+        SELECT date_trunc('month', data_avaliacao)::date, COUNT(*), COUNT(DISTINCT paciente_id),
+               AVG(tc6_distancia), percentile_cont(0.5) WITHIN GROUP (ORDER BY tc6_distancia),
+               AVG(tc6_borg_dispneia), AVG(tc6_borg_mmii), AVG(tc6_usou_o2::int)
+        FROM avaliacoes_completa WHERE {where} GROUP BY 1 ORDER BY 1
+    """, params)
+    meses = cur.fetchall()
+    # Evolução individual: diferença entre o último e o primeiro TC6 de cada paciente no período
+    cur.execute(f"""
+        SELECT COUNT(*), AVG(ultima - primeira), percentile_cont(0.5) WITHIN GROUP (ORDER BY ultima - primeira)
+        FROM (
+            SELECT (array_agg(tc6_distancia ORDER BY data_avaliacao, id))[1] AS primeira,
+                   (array_agg(tc6_distancia ORDER BY data_avaliacao DESC, id DESC))[1] AS ultima
+            FROM avaliacoes_completa WHERE {where} GROUP BY paciente_id HAVING COUNT(*) >= 2
+        ) t
+    """, params)
+    pacientes, media_var, mediana_var = cur.fetchone()
+    num = lambda v, casas=1: round(float(v), casas) if v is not None else None
+    return jsonify({
+        'meses': [{'mes': r[0].strftime('%m/%Y'), 'testes': r[1], 'pacientes': r[2], 'distancia_media': num(r[3]), 'distancia_mediana': num(r[4]),
+                   'borg_dispneia_medio': num(r[5]), 'borg_mmii_medio': num(r[6]), 'pct_o2': num(r[7], 3)} for r in meses],
+        'evolucao': {'pacientes': pacientes, 'variacao_media': num(media_var), 'variacao_mediana': num(mediana_var)}
+    })
+
+# ==========================================
+# BUSCA TEXTUAL NOS PRONTUÁRIOS
+# ==========================================
+# tsvector pelas funções de migrations/0005_busca_prontuarios.sql + índice GIN de expressão (0007).
+# A expressão da consulta tem de ser idêntica à do índice, senão o planner cai em seq scan.
+INDICES_BUSCA_PRONTUARIOS = ('idx_evolucoes_busca', 'idx_avaliacoes_busca')
+BUSCA_EVOLUCAO = "busca_evolucao(e.texto)"
+BUSCA_AVALIACAO = ("busca_avaliacao(a.diagnostico_medico, a.queixa_principal, a.hma, a.hpp, a.diagnostico_cif, a.ocupacao, "
+                   "a.avaliacao_dor, a.inspecao, a.adm, a.testes_especiais, a.objetivos, a.conduta)")
+
+@app.cli.command('reindexar-busca')
+def reindexar_busca_cmd():
+    """Reconstrói os índices GIN da busca nos prontuários sem travar escrita."""
+    conn = get_db_connection()
+    conn.autocommit = True  # REINDEX CONCURRENTLY não roda dentro de transação
+    try:
+        cur = conn.cursor()
+        for indice in INDICES_BUSCA_PRONTUARIOS:
+            cur.execute(f"REINDEX INDEX CONCURRENTLY {indice}")
+            print(f"{indice}: OK")
+        cur.execute("ANALYZE evolucoes; ANALYZE avaliacoes_completa;")
+    finally:
+        conn.autocommit = False
+
+@app.route('/api/busca_prontuarios')
+def busca_prontuarios():
+    if not session.get('logged_in'): return jsonify({}), 403
+    termo = (request.args.get('q') or '').strip()
+    if not termo: return jsonify({'resultados': [], 'tem_mais': False})
+    pagina = max(1, request.args.get('pagina', 1, type=int))
+    limite = max(1, min(request.args.get('limite', 20, type=int), 50))
+    conn = get_db_connection()
+    cur = conn.cursor()
+    # Ranqueia só pelo índice; o ts_headline (caro) roda apenas nas linhas da página
+    cur.execute(f"""
+        WITH consulta AS (SELECT websearch_to_tsquery('portuguese', %(q)s) AS q),
+        resultados AS (
+            SELECT 'evolucao' AS tipo, e.id, e.paciente_id, e.data, ts_rank({BUSCA_EVOLUCAO}, c.q) AS rank
+            FROM evolucoes e, consulta c WHERE {BUSCA_EVOLUCAO} @@ c.q
+            UNION ALL
+            SELECT 'avaliacao', a.id, a.paciente_id, a.data_avaliacao, ts_rank({BUSCA_AVALIACAO}, c.q)
+            FROM avaliacoes_completa a, consulta c WHERE {BUSCA_AVALIACAO} @@ c.q
+        ),
+        pagina AS (SELECT * FROM resultados ORDER BY rank DESC, data DESC, id DESC LIMIT %(limite)s OFFSET %(offset)s)
+        SELECT pg.tipo, pg.id, pg.paciente_id, p.nome, pg.data, pg.rank,
+               ts_headline('portuguese',
+                   CASE WHEN pg.tipo = 'evolucao' THEN e.texto
+                        ELSE concat_ws(' | ', NULLIF(a.diagnostico_medico, ''), NULLIF(a.queixa_principal, ''), NULLIF(a.hma, ''), NULLIF(a.hpp, ''),
+                                       NULLIF(a.diagnostico_cif, ''), NULLIF(a.avaliacao_dor, ''), NULLIF(a.inspecao, ''), NULLIF(a.adm, ''),
+                                       NULLIF(a.testes_especiais, ''), NULLIF(a.objetivos, ''), NULLIF(a.conduta, ''), NULLIF(a.ocupacao, '')) END,
+                   c.q, 'StartSel=⟦, StopSel=⟧, MaxFragments=2, MaxWords=25, MinWords=10, FragmentDelimiter=" … "')
+        FROM pagina pg
+        JOIN pacientes p ON p.id = pg.paciente_id
+        LEFT JOIN evolucoes e ON pg.tipo = 'evolucao' AND e.id = pg.id
+        LEFT JOIN avaliacoes_completa a ON pg.tipo = 'avaliacao' AND a.id = pg.id
+        CROSS JOIN consulta c
+        ORDER BY pg.rank DESC, pg.data DESC, pg.id DESC
+    """, {'q': termo, 'limite': limite + 1, 'offset': (pagina - 1) * limite})
+    rows = cur.fetchall()
+    return jsonify({
+        'resultados': [{'tipo': r[0], 'id': r[1], 'paciente_id': r[2], 'paciente': r[3], 'data': r[4].strftime('%d/%m/%Y %H:%M'),
+                        'rank': round(r[5], 4), 'trecho_html': html.escape(r[6] or '').replace('⟦', '<mark>').replace('⟧', '</mark>')}
+                       for r in rows[:limite]],
+        'tem_mais': len(rows) > limite
+    })
 
 # APIs padrão (eventos, evolucoes, paciente, fotos)
+CORES_STATUS = {'Agendado': '#007bff', 'Confirmado': '#17a2b8', 'Realizado': '#198754', 'Faltou': '#dc3545', 'Cancelado': '#6c757d'}
+RETENCAO_REMOVIDOS = timedelta(days=30)  # clientes com cursor mais velho que isso recarregam tudo
+MARGEM_CURSOR = timedelta(seconds=10)  # o cursor devolvido fica atrás do relógio: transações em voo ainda entram
+
+SQL_EVENTOS = "SELECT a.id, p.nome, a.start_time, a.end_time, a.obs, a.status, a.serie_id FROM agendamentos a JOIN pacientes p ON a.paciente_id = p.id"
+
+def _evento_json(row):
+    status = row[5] or 'Agendado'
+    return {'id': row[0], 'title': f"{row[1]}", 'start': row[2].isoformat(), 'end': row[3].isoformat(), 'description': row[4], 'extendedProps': {'status': status, 'serie_id': str(row[6]) if row[6] else None}, 'color': CORES_STATUS.get(status, '#007bff')}
+
+def _data_fc(valor):
+    # FullCalendar manda ISO com fuso (2024-05-05T00:00:00-03:00); o banco guarda hora local sem fuso
+    return datetime.fromisoformat(valor.replace('Z', '+00:00')).replace(tzinfo=None)
+
 @app.route('/api/eventos')
 def api_eventos():
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT a.id, p.nome, a.start_time, a.end_time, a.obs, a.status FROM agendamentos a JOIN pacientes p ON a.paciente_id = p.id")
-    rows = cur.fetchall()
-    conn.close()
-    eventos = []
-    cores = {'Agendado': '#007bff', 'Confirmado': '#17a2b8', 'Realizado': '#198754', 'Faltou': '#dc3545', 'Cancelado': '#6c757d'}
-    for row in rows:
-        status = row[5] or 'Agendado'
-        eventos.append({'id': row[0], 'title': f"{row[1]}", 'start': row[2].isoformat(), 'end': row[3].isoformat(), 'description': row[4], 'extendedProps': {'status': status}, 'color': cores.get(status, '#007bff')})
-    return jsonify(eventos)
+    sql = SQL_EVENTOS
+
+    # Modo incremental: só o que mudou desde o último fetch + ids removidos (tombstones)
+    if request.args.get('since'):
+        since = _data_fc(request.args['since'])
+        # atualizado_em vem do trigger (clock_timestamp, migrations/0011); a margem cobre quem carimbou
+        # antes do cursor e ainda não tinha commitado. Reenviar um evento repetido é inofensivo.
+        cur.execute("SELECT clock_timestamp()::timestamp - %s, LOCALTIMESTAMP - %s", (MARGEM_CURSOR, RETENCAO_REMOVIDOS))
+        cursor_novo, limite_retencao = cur.fetchone()
+        if since < limite_retencao:
+            return jsonify({'recarregar': True, 'eventos': [], 'removidos': [], 'cursor': cursor_novo.isoformat()})
+        cur.execute(sql + " WHERE a.atualizado_em > %s", (since,))
+        eventos = [_evento_json(r) for r in cur.fetchall()]
+        cur.execute("SELECT id FROM agendamentos_removidos WHERE removido_em > %s", (since,))
+        removidos = [r[0] for r in cur.fetchall()]
+        return jsonify({'recarregar': False, 'eventos': eventos, 'removidos': removidos, 'cursor': cursor_novo.isoformat()})
+
+    # Modo janela: só o período visível no calendário (FullCalendar manda start/end)
+    where, params = "", ()
+    if request.args.get('start') and request.args.get('end'):
+        inicio, fim = _data_fc(request.args['start']), _data_fc(request.args['end'])
+        # O limite inferior em start_time deixa o índice cortar o histórico; nenhuma sessão dura mais de 1 dia
+        where = " WHERE a.start_time >= %s AND a.start_time < %s AND a.end_time > %s"
+        params = (inicio - timedelta(days=1), fim, inicio)
+
+    # ETag barato (COUNT + MAX pelo índice): semana sem mudança responde 304 sem montar nada.
+    # Renomear paciente também conta: o trigger da 0011 toca os agendamentos dele.
+    cur.execute("SELECT COUNT(*), MAX(a.atualizado_em), clock_timestamp()::timestamp - %s FROM agendamentos a" + where, (MARGEM_CURSOR,) + params)
+    qtd, ultima_mudanca, cursor_novo = cur.fetchone()
+    etag = hashlib.md5(f"{request.args.get('start')}|{request.args.get('end')}|{qtd}|{ultima_mudanca}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        cur.execute(sql + where, params)
+        resp = jsonify([_evento_json(r) for r in cur.fetchall()])
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.headers['X-Agenda-Cursor'] = cursor_novo.isoformat()
+    return resp
+
+# ==========================================
+# AGENDA AO VIVO (LISTEN/NOTIFY + SSE)
+# ==========================================
+# Cada escrita em agendamentos dispara um NOTIFY (trigger da migrations/0008). Cada worker mantém UMA
+# conexão em LISTEN fora do pool, lê os eventos alterados uma vez por aviso e repassa prontos para
+# todas as telas abertas via Server-Sent Events: dez recepções abertas não viram dez consultas.
+# No gunicorn use o worker gevent (gunicorn.conf.py), já que cada tela segura uma resposta aberta.
+SSE_KEEPALIVE = 25  # segundos entre comentários de keep-alive (proxies derrubam conexão ociosa)
+
+class OuvinteAgenda:
+    def __init__(self):
+        self._assinantes = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._rodar, name='ouvinte-agenda', daemon=True).start()
+
+    def assinar(self):
+        fila = queue.Queue(maxsize=100)
+        with self._lock: self._assinantes.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        with self._lock: self._assinantes.discard(fila)
+
+    def _publicar(self, mensagem):
+        with self._lock: assinantes = list(self._assinantes)
+        for fila in assinantes:
+            try: fila.put_nowait(mensagem)
+            except queue.Full:
+                # Tela que não está consumindo (aba congelada...): descarta o acumulado e manda ressincronizar
+                with fila.mutex: fila.queue.clear()
+                fila.put_nowait({'tipo': 'sincronizar'})
+
+    def _rodar(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**_dsn())
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute("LISTEN agenda")
+                # Avisos perdidos enquanto estava desconectado: as telas buscam pelo ?since=
+                self._publicar({'tipo': 'sincronizar'})
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        cur.execute("SELECT 1")  # conexão morta aparece aqui
+                        continue
+                    conn.poll()
+                    avisos = [json.loads(n.payload) for n in conn.notifies]
+                    conn.notifies.clear()
+                    self._tratar(cur, avisos)
+            except Exception as e:
+                app.logger.error("Ouvinte da agenda: %s", e)
+                if conn is not None and not conn.closed: conn.close()
+                time.sleep(5)
+
+    def _tratar(self, cur, avisos):
+        # Junta a rajada de avisos (ex.: série criada e movida em seguida) numa consulta só
+        if any(a['op'] == 'recarregar' for a in avisos): return self._publicar({'tipo': 'recarregar'})
+        atualizados = {i for a in avisos if a['op'] == 'atualizar' for i in a['ids']}
+        removidos = sorted({i for a in avisos if a['op'] == 'remover' for i in a['ids']})
+        if atualizados:
+            cur.execute(SQL_EVENTOS + " WHERE a.id = ANY(%s)", (list(atualizados),))
+            eventos = [_evento_json(r) for r in cur.fetchall()]
+            if eventos: self._publicar({'tipo': 'atualizar', 'eventos': eventos})
+        if removidos: self._publicar({'tipo': 'remover', 'ids': removidos})
+
+_ouvinte_agenda = None
+_ouvinte_pid = None
+
+def get_ouvinte_agenda():
+    global _ouvinte_agenda, _ouvinte_pid
+    if _ouvinte_agenda is None or _ouvinte_pid != os.getpid():
+        with _pool_lock:
+            if _ouvinte_agenda is None or _ouvinte_pid != os.getpid():
+                _ouvinte_agenda = OuvinteAgenda()
+                _ouvinte_pid = os.getpid()
+    return _ouvinte_agenda
+
+@app.route('/api/agenda/stream')
+def agenda_stream():
+    if not session.get('logged_in'): return jsonify({}), 403
+    if not os.environ.get("DB_HOST"): return jsonify({}), 503
+    ouvinte = get_ouvinte_agenda()
+    fila = ouvinte.assinar()
+
+    def transmitir():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try: mensagem = fila.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {json.dumps(mensagem)}\n\n"
+        finally:
+            ouvinte.cancelar(fila)
+
+    return Response(transmitir(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _registrar_removidos(cur, ids):
+    if not ids: return
+    cur.execute("INSERT INTO agendamentos_removidos (id) SELECT unnest(%s::int[]) ON CONFLICT (id) DO UPDATE SET removido_em = clock_timestamp()", (list(ids),))
+    cur.execute("DELETE FROM agendamentos_removidos WHERE removido_em < NOW() - %s", (RETENCAO_REMOVIDOS,))
+
+DURACAO_SESSAO = timedelta(hours=1)
+
+def _expandir_recorrencia(inicio, dias, semanas):
+    # dias: 0=Seg ... 5=Sáb (mesma convenção do weekday() e dos checkboxes da agenda)
+    ocorrencias = {inicio}
+    segunda = inicio - timedelta(days=inicio.weekday())
+    for s in range(semanas):
+        for d in dias:
+            dt = segunda + timedelta(weeks=s, days=d)
+            if dt >= inicio: ocorrencias.add(dt)
+    return sorted(ocorrencias)
+
+TRAVA_AGENDA = 72400002  # pg_advisory_xact_lock: checagem de conflito + escrita sem corrida entre recepções
+
+def _conflitos(cur, faixas, ignorar_ids=()):
+    # Sessões já marcadas (não canceladas) que se sobrepõem a alguma das faixas (inicio, fim);
+    # tsrange && usa o índice GiST idx_agendamentos_faixa (migrations/0010)
+    cur.execute("""
+        SELECT o.inicio, a.id, p.nome, a.start_time FROM unnest(%s::timestamp[], %s::timestamp[]) AS o(inicio, fim)
+        JOIN agendamentos a ON tsrange(a.start_time, a.end_time) && tsrange(o.inicio, o.fim)
+        JOIN pacientes p ON a.paciente_id = p.id
+        WHERE COALESCE(a.status, 'Agendado') <> 'Cancelado' AND NOT (a.id = ANY(%s::int[]))
+        ORDER BY o.inicio
+    """, ([f[0] for f in faixas], [f[1] for f in faixas], list(ignorar_ids)))
+    return [{'inicio': r[0].isoformat(), 'id': r[1], 'paciente': r[2], 'start': r[3].isoformat()} for r in cur.fetchall()]
+
+def _travar_agenda(cur):
+    # Até o COMMIT: duas recepções marcando o mesmo horário ao mesmo tempo não passam as duas pela checagem
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (TRAVA_AGENDA,))
+
+def _resposta_conflito(conn, conflitos):
+    # Horário ocupado só é gravado se a tela confirmar e reenviar com forcar=true (turmas de Pilates, encaixes)
+    conn.rollback()
+    return jsonify({'status': 'conflito', 'conflitos': conflitos}), 409
 
 @app.route('/api/criar_evento', methods=['POST'])
 def criar_evento():
@@ -344,50 +1144,163 @@ def criar_evento():
     cur = conn.cursor()
     try:
         start = datetime.fromisoformat(d['start'])
-        cur.execute("INSERT INTO agendamentos (paciente_id, start_time, end_time, obs, status) VALUES (%s, %s, %s, %s, 'Agendado')", (d['paciente_id'], start, start + timedelta(hours=1), d.get('obs', '')))
+        dias = sorted({int(x) for x in d.get('dias_recorrentes') or [] if 0 <= int(x) <= 6})
+        semanas = max(1, min(int(d.get('semanas') or 1), 52))
+        inicios = _expandir_recorrencia(start, dias, semanas)
+        serie_id = str(uuid.uuid4()) if len(inicios) > 1 else None
+
+        _travar_agenda(cur)
+        conflitos = _conflitos(cur, [(i, i + DURACAO_SESSAO) for i in inicios])
+        if conflitos and not d.get('forcar'): return _resposta_conflito(conn, conflitos)
+        # Todas as ocorrências num único INSERT, na mesma transação
+        ids = execute_values(cur, "INSERT INTO agendamentos (paciente_id, start_time, end_time, obs, status, serie_id) VALUES %s RETURNING id",
+                             [(d['paciente_id'], i, i + DURACAO_SESSAO, d.get('obs', ''), 'Agendado', serie_id) for i in inicios],
+                             template="(%s, %s, %s, %s, %s, %s::uuid)", page_size=len(inicios), fetch=True)
         conn.commit()
-        return jsonify({'status': 'success'})
+        return jsonify({'status': 'success', 'criados': len(ids), 'serie_id': serie_id, 'conflitos': conflitos})
     except: return jsonify({'status': 'error'}), 500
-    finally: conn.close()
+
+# Operações em série: um UPDATE/DELETE só para todas as ocorrências (a partir de uma data, se informada)
+def _filtro_serie(d):
+    where, params = "serie_id = %s::uuid", [d['serie_id']]
+    if d.get('a_partir_de'):
+        where += " AND start_time >= %s"
+        params.append(_data_fc(d['a_partir_de']))
+    return where, params
+
+@app.route('/api/mover_serie', methods=['POST'])
+def mover_serie():
+    if not session.get('logged_in'): return jsonify({}), 403
+    d = request.json
+    conn = get_db_connection()
+    cur = conn.cursor()
+    where, params = _filtro_serie(d)
+    delta = timedelta(minutes=int(d['delta_minutos']))
+    _travar_agenda(cur)
+    cur.execute(f"SELECT id, start_time + %s, end_time + %s, COALESCE(status, 'Agendado') <> 'Cancelado' FROM agendamentos WHERE {where}", [delta, delta] + params)
+    serie = cur.fetchall()
+    conflitos = _conflitos(cur, [(r[1], r[2]) for r in serie if r[3]], [r[0] for r in serie])
+    if conflitos and not d.get('forcar'): return _resposta_conflito(conn, conflitos)
+    cur.execute(f"UPDATE agendamentos SET start_time = start_time + %s, end_time = end_time + %s WHERE {where}", [delta, delta] + params)
+    afetados = cur.rowcount
+    conn.commit()
+    return jsonify({'status': 'success', 'afetados': afetados})
+
+@app.route('/api/cancelar_serie', methods=['POST'])
+def cancelar_serie():
+    if not session.get('logged_in'): return jsonify({}), 403
+    d = request.json
+    conn = get_db_connection()
+    cur = conn.cursor()
+    where, params = _filtro_serie(d)
+    cur.execute(f"UPDATE agendamentos SET status = 'Cancelado' WHERE {where}", params)
+    afetados = cur.rowcount
+    conn.commit()
+    return jsonify({'status': 'success', 'afetados': afetados})
+
+@app.route('/api/deletar_serie', methods=['POST'])
+def deletar_serie():
+    if not session.get('logged_in'): return jsonify({}), 403
+    d = request.json
+    conn = get_db_connection()
+    cur = conn.cursor()
+    where, params = _filtro_serie(d)
+    cur.execute(f"DELETE FROM agendamentos WHERE {where} RETURNING id", params)
+    ids = [r[0] for r in cur.fetchall()]
+    _registrar_removidos(cur, ids)
+    conn.commit()
+    return jsonify({'status': 'success', 'afetados': len(ids)})
 
 @app.route('/api/mover_evento', methods=['POST'])
 def mover_evento():
     d = request.json
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("UPDATE agendamentos SET start_time = %s, end_time = %s WHERE id = %s", (d['start'], d['end'], d['id']))
+    start, end = _data_fc(d['start']), _data_fc(d['end'])
+    _travar_agenda(cur)
+    cur.execute("SELECT COALESCE(status, 'Agendado') <> 'Cancelado' FROM agendamentos WHERE id = %s", (d['id'],))
+    ocupa = cur.fetchone()
+    conflitos = _conflitos(cur, [(start, end)] if ocupa and ocupa[0] else [], [d['id']])
+    if conflitos and not d.get('forcar'): return _resposta_conflito(conn, conflitos)
+    cur.execute("UPDATE agendamentos SET start_time = %s, end_time = %s WHERE id = %s", (start, end, d['id']))
     conn.commit()
-    conn.close()
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', 'conflitos': conflitos})
 
 @app.route('/api/atualizar_evento', methods=['POST'])
 def atualizar_evento():
     d = request.json
     conn = get_db_connection()
     cur = conn.cursor()
+    conflitos = []
+    if d['status'] != 'Cancelado':
+        # Reativar uma sessão cancelada também pode cair num horário já ocupado
+        _travar_agenda(cur)
+        cur.execute("SELECT start_time, end_time FROM agendamentos WHERE id = %s AND status = 'Cancelado'", (d['id'],))
+        conflitos = _conflitos(cur, cur.fetchall(), [d['id']])
+        if conflitos and not d.get('forcar'): return _resposta_conflito(conn, conflitos)
     cur.execute("UPDATE agendamentos SET status = %s, obs = %s WHERE id = %s", (d['status'], d['obs'], d['id']))
     conn.commit()
-    conn.close()
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', 'conflitos': conflitos})
 
 @app.route('/api/deletar_evento', methods=['POST'])
 def deletar_evento():
     d = request.json
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("DELETE FROM agendamentos WHERE id = %s", (d['id'],))
+    cur.execute("DELETE FROM agendamentos WHERE id = %s RETURNING id", (d['id'],))
+    _registrar_removidos(cur, [r[0] for r in cur.fetchall()])
     conn.commit()
-    conn.close()
     return jsonify({'status': 'success'})
 
+# Horários livres: candidatos gerados no próprio Postgres (generate_series por dia e por passo dentro do
+# expediente) e descartados por NOT EXISTS no índice GiST de faixas; nada da agenda passa pelo Python.
+EXPEDIENTE = (timedelta(hours=7), timedelta(hours=20))  # mesmos limites do slotMinTime/slotMaxTime da agenda.html
+DIAS_SEM_EXPEDIENTE = [0]  # extract(dow): 0 = domingo
+
+@app.route('/api/disponibilidade')
+def disponibilidade():
+    if not session.get('logged_in'): return jsonify({}), 403
+    try:
+        inicio = _data_fc(request.args['start']) if request.args.get('start') else datetime.combine(date.today(), datetime.min.time())
+        fim = _data_fc(request.args['end']) if request.args.get('end') else inicio + timedelta(days=7)
+        duracao = timedelta(minutes=int(request.args.get('duracao') or DURACAO_SESSAO.total_seconds() // 60))
+        passo = timedelta(minutes=int(request.args.get('passo') or duracao.total_seconds() // 60))
+    except ValueError: return jsonify({'erro': 'Parâmetros inválidos'}), 400
+    if not (timedelta(minutes=15) <= duracao <= EXPEDIENTE[1] - EXPEDIENTE[0]) or passo < timedelta(minutes=15):
+        return jsonify({'erro': 'Duração/passo fora do expediente (mínimo 15 minutos)'}), 400
+    if fim - inicio > timedelta(days=62): return jsonify({'erro': 'Período máximo de 62 dias'}), 400
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT s.inicio, s.inicio + %(duracao)s
+        FROM generate_series(%(inicio)s::date::timestamp, %(fim)s::date::timestamp, INTERVAL '1 day') AS d(dia)
+        CROSS JOIN LATERAL generate_series(d.dia + %(abre)s, d.dia + %(fecha)s - %(duracao)s, %(passo)s) AS s(inicio)
+        WHERE extract(dow FROM d.dia) <> ALL(%(fechados)s)
+          AND s.inicio >= GREATEST(%(inicio)s, LOCALTIMESTAMP) AND s.inicio + %(duracao)s <= %(fim)s
+          AND NOT EXISTS (SELECT 1 FROM agendamentos a
+                          WHERE tsrange(a.start_time, a.end_time) && tsrange(s.inicio, s.inicio + %(duracao)s)
+                            AND COALESCE(a.status, 'Agendado') <> 'Cancelado')
+        ORDER BY s.inicio
+    """, {'inicio': inicio, 'fim': fim, 'duracao': duracao, 'passo': passo, 'abre': EXPEDIENTE[0], 'fecha': EXPEDIENTE[1],
+          'fechados': DIAS_SEM_EXPEDIENTE})
+    return jsonify({'livres': [{'start': r[0].isoformat(), 'end': r[1].isoformat()} for r in cur.fetchall()]})
+
+def _pagina_evolucoes(cur, pid, limite, filtro="", params=()):
+    rows, tem_mais = _pagina_keyset(cur, f"SELECT id, data, texto FROM evolucoes WHERE paciente_id = %s{filtro} ORDER BY data DESC, id DESC", [pid] + list(params), limite)
+    return {
+        'evolucoes': [{'id': r[0], 'data': r[1].strftime("%d/%m/%Y %H:%M"), 'texto': r[2]} for r in rows],
+        'proximo': {'antes_data': rows[-1][1].isoformat(), 'antes_id': rows[-1][0]} if tem_mais else None
+    }
+
 @app.route('/api/evolucoes/<int:pid>', methods=['GET'])
 def get_evolucoes(pid):
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT data, texto FROM evolucoes WHERE paciente_id = %s ORDER BY data DESC", (pid,))
-    data = [{'data': r[0].strftime("%d/%m/%Y %H:%M"), 'texto': r[1]} for r in cur.fetchall()]
-    conn.close()
-    return jsonify(data)
+    limite = max(1, min(request.args.get('limite', 20, type=int), 100))
+    try: filtro, params = _filtro_antes('data')
+    except ValueError as e: return jsonify({'status': 'error', 'msg': f'Cursor de paginação inválido: {e}'}), 400
+    return jsonify(_pagina_evolucoes(cur, pid, limite, filtro, params))
 
 @app.route('/api/nova_evolucao', methods=['POST'])
 def nova_evolucao():
@@ -396,19 +1309,109 @@ def nova_evolucao():
     cur = conn.cursor()
     cur.execute("INSERT INTO evolucoes (paciente_id, texto, data) VALUES (%s, %s, NOW())", (d['paciente_id'], d['texto']))
     conn.commit()
-    conn.close()
     return jsonify({'status': 'success'})
 
+# Busca de pacientes: keyset por (nome normalizado, id), sem OFFSET, sempre pelos índices idx_pacientes_*_busca
+def _like_prefixo(termo):
+    return termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+@app.route('/api/pacientes/buscar')
+def buscar_pacientes():
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    termo = (request.args.get('q') or '').strip()
+    limite = max(1, min(request.args.get('limite', 20, type=int), 100))
+    chave = 'normalizar_busca(nome) COLLATE "C"'
+
+    where, params = [], []
+    digitos = re.sub(r'\D', '', termo)
+    if termo and digitos and len(digitos) == len(re.sub(r'[\s().\-/+]', '', termo)):
+        # Só números (com ou sem máscara): CPF ou telefone
+        where.append("(regexp_replace(cpf, '\\D', '', 'g') LIKE %s OR regexp_replace(telefone, '\\D', '', 'g') LIKE %s)")
+        params += [_like_prefixo(digitos)] * 2
+    elif termo:
+        where.append(f"{chave} LIKE normalizar_busca(%s)")
+        params.append(_like_prefixo(termo))
+    if request.args.get('apos_id'):
+        where.append(f"({chave}, id) > (%s, %s)")
+        params += [request.args.get('apos_nome', ''), request.args.get('apos_id', type=int)]
+
+    cur.execute(f"""
+        SELECT id, nome, data_nascimento, telefone, cpf, date_part('year', age(data_nascimento))::int, {chave}
+        FROM pacientes {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY {chave}, id LIMIT %s
+    """, params + [limite + 1])
+    rows = cur.fetchall()
+    proximo = {'apos_nome': rows[limite - 1][6], 'apos_id': rows[limite - 1][0]} if len(rows) > limite else None
+    return jsonify({
+        'pacientes': [{'id': r[0], 'nome': r[1], 'data_nascimento': r[2].strftime('%d/%m/%Y') if r[2] else None,
+                       'telefone': r[3], 'cpf': r[4], 'idade': r[5]} for r in rows[:limite]],
+        'proximo': proximo
+    })
+
 @app.route('/api/get_paciente/<int:id>', methods=['GET'])
 def get_paciente(id):
     conn = get_db_connection()
     cur = conn.cursor()
     cur.execute('SELECT id, nome, data_nascimento, telefone, cpf, endereco FROM pacientes WHERE id = %s', (id,))
     p = cur.fetchone()
-    conn.close()
     if p: return jsonify({'id': p[0], 'nome': p[1], 'data_nascimento': p[2].strftime('%Y-%m-%d') if p[2] else '', 'telefone': p[3], 'cpf': p[4], 'endereco': p[5]})
     return jsonify({'erro': 'Paciente não encontrado'}), 404
 
+def _json_comprimido(payload):
+    resp = jsonify(payload)
+    # Só compensa gzipar acima de ~1 KB; abaixo disso o cabeçalho custa mais que a economia
+    if 'gzip' in request.accept_encodings and len(resp.get_data()) > 1024:
+        resp.set_data(gzip.compress(resp.get_data(), compresslevel=6))
+        resp.headers['Content-Encoding'] = 'gzip'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+# Abertura do prontuário: tudo que a primeira tela precisa numa conexão, numa transação e numa resposta
+@app.route('/api/prontuario/<int:pid>', methods=['GET'])
+def get_prontuario(pid):
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        # Snapshot único: contagens e listas enxergam o mesmo estado do banco
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.execute("""
+            SELECT id, nome, data_nascimento, telefone, cpf, endereco, date_part('year', age(data_nascimento))::int,
+                   (SELECT COUNT(*) FROM evolucoes WHERE paciente_id = p.id),
+                   (SELECT COUNT(*) FROM avaliacoes_completa WHERE paciente_id = p.id),
+                   (SELECT COUNT(*) FILTER (WHERE status = 'Realizado') FROM agendamentos WHERE paciente_id = p.id),
+                   (SELECT COUNT(*) FILTER (WHERE status = 'Faltou') FROM agendamentos WHERE paciente_id = p.id)
+            FROM pacientes p WHERE id = %s
+        """, (pid,))
+        p = cur.fetchone()
+        if not p: return jsonify({'erro': 'Paciente não encontrado'}), 404
+
+        cur.execute(SQL_AVALIACAO + " WHERE paciente_id = %s ORDER BY data_avaliacao DESC, id DESC LIMIT 1", (pid,))
+        ultima = cur.fetchone()
+        evolucoes = _pagina_evolucoes(cur, pid, 20)
+        avaliacoes = _pagina_avaliacoes(cur, pid, 10)
+        cur.execute("""
+            SELECT id, start_time, end_time, COALESCE(status, 'Agendado') FROM agendamentos
+            WHERE paciente_id = %s AND start_time >= LOCALTIMESTAMP AND COALESCE(status, 'Agendado') <> 'Cancelado'
+            ORDER BY start_time LIMIT 5
+        """, (pid,))
+        proximas = [{'id': r[0], 'start': r[1].isoformat(), 'end': r[2].isoformat(), 'status': r[3]} for r in cur.fetchall()]
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+    return _json_comprimido({
+        'paciente': {'id': p[0], 'nome': p[1], 'data_nascimento': p[2].strftime('%Y-%m-%d') if p[2] else '', 'telefone': p[3], 'cpf': p[4], 'endereco': p[5], 'idade': p[6]},
+        'contagens': {'evolucoes': p[7], 'avaliacoes': p[8], 'sessoes_realizadas': p[9], 'faltas': p[10]},
+        'ultima_avaliacao': _avaliacao_json(ultima) if ultima else {'encontrado': False},
+        'evolucoes': evolucoes,
+        'avaliacoes': avaliacoes,
+        'proximas_sessoes': proximas
+    })
+
 @app.route('/api/salvar_paciente', methods=['POST'])
 def salvar_paciente():
     data = request.json
@@ -425,7 +1428,6 @@ def salvar_paciente():
         conn.commit()
         return jsonify({'mensagem': 'Salvo!'})
     except Exception as e: return jsonify({'erro': str(e)}), 500
-    finally: conn.close()
 
 @app.route('/delete_paciente_via_form/<int:id>', methods=['POST'])
 def delete_paciente_via_form(id):
@@ -433,11 +1435,486 @@ def delete_paciente_via_form(id):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("DELETE FROM pacientes WHERE id = %s", (id,))
+        # Sessões apagadas em cascata também viram tombstones para o feed da agenda
+        cur.execute("SELECT id FROM agendamentos WHERE paciente_id = %s", (id,))
+        _registrar_removidos(cur, [r[0] for r in cur.fetchall()])
+        cur.execute("DELETE FROM pacientes WHERE id = %s RETURNING (SELECT array_agg(chave) FROM fotos WHERE paciente_id = %s)", (id, id))
+        chaves = (cur.fetchone() or [None])[0] or []
         conn.commit()
+        _descartar_arquivos(cur, chaves)
     except: pass
-    finally: conn.close()
     return redirect(url_for('pacientes'))
 
+# ==========================================
+# FOTOS DA AVALIAÇÃO POSTURAL
+# ==========================================
+# Arquivos fora do banco, endereçados pelo SHA-256 do conteúdo; a tabela fotos (migrations/0009) guarda
+# só os metadados. A mesma imagem enviada duas vezes ocupa o disco uma vez e a URL de um conteúdo nunca
+# muda, então o navegador guarda em cache por um ano. Miniaturas saem de um pool de threads em segundo plano.
+FOTOS_DIR = os.environ.get("FOTOS_DIR", os.path.join(app.root_path, 'dados', 'fotos'))
+FOTOS_MAX_MB = int(os.environ.get("FOTOS_MAX_MB", 20))
+FOTOS_THREADS_MINIATURA = int(os.environ.get("FOTOS_THREADS_MINIATURA", 2))
+FOTOS_MINIATURA_PX = 480
+FOTOS_CACHE_SEGUNDOS = 365 * 24 * 3600
+VISTAS_FOTO = ('frontal', 'posterior', 'lat_dir', 'lat_esq', 'outra')
+FORMATOS_FOTO = {'JPEG': ('jpg', 'image/jpeg'), 'PNG': ('png', 'image/png'), 'WEBP': ('webp', 'image/webp')}
+MIME_FOTO = {extensao: mime for extensao, mime in FORMATOS_FOTO.values()}
+RE_CHAVE_FOTO = re.compile(r'^[0-9a-f]{64}\.(jpg|png|webp)$')
+TRAVA_FOTOS = 72400003  # pg_advisory_xact_lock(TRAVA_FOTOS, hashtext(chave)): envio e descarte do mesmo conteúdo em série
+
+class ArmazemLocal:
+    # Outro armazém (S3, MinIO...) só precisa oferecer estes métodos; as rotas não sabem onde o arquivo mora
+    def __init__(self, raiz):
+        self.raiz = raiz
+
+    def caminho(self, chave):
+        return os.path.join(self.raiz, chave[:2], chave[2:4], chave)
+
+    def existe(self, chave):
+        return os.path.exists(self.caminho(chave))
+
+    def temporario(self):
+        # Mesmo sistema de arquivos do destino, para o os.replace do guardar() ser atômico
+        pasta = os.path.join(self.raiz, 'tmp')
+        os.makedirs(pasta, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=pasta, delete=False)
+
+    def guardar(self, chave, origem):
+        destino = self.caminho(chave)
+        if os.path.exists(destino): return os.remove(origem)  # conteúdo igual já guardado
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(origem, destino)
+
+    def remover(self, chave):
+        try: os.remove(self.caminho(chave))
+        except FileNotFoundError: pass
+
+    def resposta(self, chave, mimetype):
+        # conditional=True: ETag/304 e Range (206) pelo próprio Werkzeug
+        resp = send_file(self.caminho(chave), mimetype=mimetype, conditional=True, etag=chave, max_age=FOTOS_CACHE_SEGUNDOS)
+        resp.cache_control.public = False
+        resp.cache_control.private = True  # foto de paciente: só o navegador guarda, proxy não
+        resp.cache_control.immutable = True
+        return resp
+
+armazem_fotos = ArmazemLocal(FOTOS_DIR)
+
+def _chave_miniatura(chave):
+    return chave.rsplit('.', 1)[0] + '.mini.jpg'
+
+def _receber_foto(origem):
+    # Copia em blocos calculando o hash: a imagem nunca fica inteira na memória
+    h, tamanho, limite = hashlib.sha256(), 0, FOTOS_MAX_MB * 1024 * 1024
+    with armazem_fotos.temporario() as tmp:
+        for bloco in iter(lambda: origem.read(65536), b''):
+            h.update(bloco)
+            tamanho += len(bloco)
+            if tamanho > limite: break
+            tmp.write(bloco)
+    try:
+        if tamanho > limite: raise ValueError(f"Foto acima de {FOTOS_MAX_MB} MB")
+        try:
+            with Image.open(tmp.name) as img: formato, largura, altura = img.format, img.width, img.height  # só o cabeçalho
+        except Exception: raise ValueError("Arquivo não é uma imagem válida")
+        if formato not in FORMATOS_FOTO: raise ValueError(f"Formato {formato} não aceito (use JPEG, PNG ou WEBP)")
+    except ValueError:
+        os.remove(tmp.name)
+        raise
+    extensao, mime = FORMATOS_FOTO[formato]
+    # O arquivo só vai para o armazém com a trava da chave (enviar_foto): até lá fica no temporário
+    return {'chave': f"{h.hexdigest()}.{extensao}", 'tipo_mime': mime, 'tamanho': tamanho, 'largura': largura, 'altura': altura,
+            'temporario': tmp.name}
+
+def _gerar_miniatura(chave):
+    mini = _chave_miniatura(chave)
+    if armazem_fotos.existe(mini): return mini
+    with Image.open(armazem_fotos.caminho(chave)) as img:
+        img.draft('RGB', (FOTOS_MINIATURA_PX * 2, FOTOS_MINIATURA_PX * 2))  # JPEG já decodifica reduzido
+        img = ImageOps.exif_transpose(img)  # foto de celular: orientação vem no EXIF
+        img.thumbnail((FOTOS_MINIATURA_PX, FOTOS_MINIATURA_PX))
+        with armazem_fotos.temporario() as tmp: img.convert('RGB').save(tmp, 'JPEG', quality=80, optimize=True)
+    armazem_fotos.guardar(mini, tmp.name)
+    return mini
+
+_miniaturas = None
+_miniaturas_pid = None
+_miniaturas_pendentes = {}
+_miniaturas_lock = threading.Lock()
+
+def _executor_miniaturas():
+    global _miniaturas, _miniaturas_pid
+    if _miniaturas is None or _miniaturas_pid != os.getpid():
+        with _pool_lock:
+            if _miniaturas is None or _miniaturas_pid != os.getpid():
+                # No worker gevent o threading vira greenlet e o redimensionamento travaria o worker inteiro;
+                # o executor do gevent usa threads de verdade
+                monkey = sys.modules.get('gevent.monkey')
+                if monkey and monkey.is_module_patched('threading'):
+                    from gevent.threadpool import ThreadPoolExecutor
+                else:
+                    from concurrent.futures import ThreadPoolExecutor
+                _miniaturas = ThreadPoolExecutor(max_workers=FOTOS_THREADS_MINIATURA)
+                _miniaturas_pid = os.getpid()
+    return _miniaturas
+
+def agendar_miniatura(chave):
+    # Uma geração por arquivo, mesmo com várias telas pedindo a mesma miniatura ao mesmo tempo
+    executor = _executor_miniaturas()
+    with _miniaturas_lock:
+        tarefa = _miniaturas_pendentes.get(chave)
+        if tarefa is None:
+            tarefa = _miniaturas_pendentes[chave] = executor.submit(_gerar_miniatura, chave)
+    tarefa.add_done_callback(lambda t: _miniaturas_pendentes.pop(chave, None))
+    return tarefa
+
+def _travar_chaves(cur, chaves):
+    # Sempre na mesma ordem: dois descartes com chaves em comum não se travam um ao outro
+    for chave in sorted(set(chaves)): cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (TRAVA_FOTOS, chave))
+
+def _descartar_arquivos(cur, chaves):
+    # Conteúdo compartilhado (mesma imagem em outra foto) fica; só some o que ninguém mais referencia.
+    # Chamado depois do commit que apagou as linhas; o arquivo sai com a trava da chave ainda presa,
+    # então um envio do mesmo conteúdo ou vê a linha ainda aqui ou espera e grava o arquivo de novo.
+    chaves = sorted(set(chaves))
+    if not chaves: return
+    _travar_chaves(cur, chaves)
+    cur.execute("SELECT DISTINCT chave FROM fotos WHERE chave = ANY(%s)", (chaves,))
+    em_uso = {r[0] for r in cur.fetchall()}
+    for chave in chaves:
+        if chave in em_uso: continue
+        armazem_fotos.remover(chave)
+        armazem_fotos.remover(_chave_miniatura(chave))
+    cur.connection.commit()  # solta as travas
+
+def _foto_json(r):
+    return {'id': r[0], 'vista': r[1], 'data': r[2].isoformat(), 'legenda': r[3] or '', 'largura': r[5], 'altura': r[6],
+            'url': url_for('foto_arquivo', chave=r[4]), 'miniatura': url_for('foto_miniatura', chave=r[4])}
+
+SQL_FOTOS = "SELECT id, vista, data_foto, legenda, chave, largura, altura FROM fotos"
+
+@app.route('/api/fotos/<int:pid>', methods=['GET'])
+def listar_fotos(pid):
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(SQL_FOTOS + " WHERE paciente_id = %s ORDER BY data_foto DESC, id DESC", (pid,))
+    return jsonify({'fotos': [_foto_json(r) for r in cur.fetchall()]})
+
+@app.route('/api/fotos/<int:pid>', methods=['POST'])
+def enviar_foto(pid):
+    if not session.get('logged_in'): return jsonify({}), 403
+    if request.content_length and request.content_length > FOTOS_MAX_MB * 1024 * 1024:
+        return jsonify({'erro': f'Foto acima de {FOTOS_MAX_MB} MB'}), 413
+    arquivo = request.files.get('foto')
+    vista = request.form.get('vista') or 'outra'
+    if not arquivo: return jsonify({'erro': 'Envie o arquivo no campo "foto"'}), 400
+    if vista not in VISTAS_FOTO: return jsonify({'erro': f'Vista inválida: {vista}'}), 400
+    try: foto = _receber_foto(arquivo.stream)
+    except ValueError as e: return jsonify({'erro': str(e)}), 400
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        # Trava, arquivo e linha na mesma transação: um descarte concorrente não apaga o que acabou de entrar
+        _travar_chaves(cur, [foto['chave']])
+        armazem_fotos.guardar(foto['chave'], foto['temporario'])
+        cur.execute("""
+            INSERT INTO fotos (paciente_id, vista, data_foto, chave, tipo_mime, tamanho, largura, altura, legenda)
+            VALUES (%s, %s, COALESCE(%s::timestamp, LOCALTIMESTAMP), %s, %s, %s, %s, %s, %s)
+            RETURNING id, vista, data_foto, legenda, chave, largura, altura
+        """, (pid, vista, request.form.get('data') or None, foto['chave'], foto['tipo_mime'], foto['tamanho'],
+              foto['largura'], foto['altura'], request.form.get('legenda') or None))
+        r = cur.fetchone()
+        conn.commit()
+        agendar_miniatura(foto['chave'])
+        return jsonify({'status': 'success', 'foto': _foto_json(r)})
+    except Exception as e:
+        conn.rollback()
+        if os.path.exists(foto['temporario']): os.remove(foto['temporario'])
+        _descartar_arquivos(cur, [foto['chave']])
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/fotos/deletar', methods=['POST'])
+def deletar_foto():
+    if not session.get('logged_in'): return jsonify({}), 403
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM fotos WHERE id = %s RETURNING chave", (request.json['id'],))
+    chaves = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    _descartar_arquivos(cur, chaves)
+    return jsonify({'status': 'success'})
+
+# Servidas direto do armazém, sem consultar o banco: a chave já é o conteúdo
+@app.route('/fotos/<chave>')
+def foto_arquivo(chave):
+    if not session.get('logged_in'): return jsonify({}), 403
+    if not RE_CHAVE_FOTO.match(chave) or not armazem_fotos.existe(chave): return jsonify({}), 404
+    return armazem_fotos.resposta(chave, MIME_FOTO[chave.rsplit('.', 1)[1]])
+
+@app.route('/fotos/<chave>/miniatura')
+def foto_miniatura(chave):
+    if not session.get('logged_in'): return jsonify({}), 403
+    if not RE_CHAVE_FOTO.match(chave) or not armazem_fotos.existe(chave): return jsonify({}), 404
+    mini = _chave_miniatura(chave)
+    if not armazem_fotos.existe(mini):
+        # Ainda na fila (ou gerada em outro worker que caiu): espera a geração em vez de mandar a original
+        try: agendar_miniatura(chave).result(timeout=30)
+        except Exception as e:
+            app.logger.error("Miniatura de %s: %s", chave, e)
+            return jsonify({'erro': 'Miniatura indisponível'}), 503
+    return armazem_fotos.resposta(mini, 'image/jpeg')
+
+@app.cli.command('migrar-fotos-legadas')
+def migrar_fotos_legadas_cmd():
+    """Move as fotos base64 de avaliacao_postural para o armazém de arquivos."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM avaliacao_postural WHERE COALESCE(foto_frontal, foto_posterior, foto_lat_dir, foto_lat_esq) IS NOT NULL ORDER BY id")
+    movidas = 0
+    # Uma avaliação por transação: interrompido no meio, basta rodar de novo
+    for (aid,) in cur.fetchall():
+        cur.execute("SELECT paciente_id, data_foto, foto_frontal, foto_posterior, foto_lat_dir, foto_lat_esq FROM avaliacao_postural WHERE id = %s FOR UPDATE", (aid,))
+        pid, data_foto, *fotos = cur.fetchone()
+        try:
+            for vista, valor in zip(('frontal', 'posterior', 'lat_dir', 'lat_esq'), fotos):
+                if not valor: continue
+                # "data:image/jpeg;base64,..." (canvas/FileReader) ou só o base64
+                foto = _receber_foto(io.BytesIO(base64.b64decode(valor.split(',', 1)[-1])))
+                _travar_chaves(cur, [foto['chave']])
+                armazem_fotos.guardar(foto['chave'], foto['temporario'])
+                agendar_miniatura(foto['chave'])
+                cur.execute("""
+                    INSERT INTO fotos (paciente_id, avaliacao_postural_id, vista, data_foto, chave, tipo_mime, tamanho, largura, altura)
+                    VALUES (%s, %s, %s, COALESCE(%s, LOCALTIMESTAMP), %s, %s, %s, %s, %s)
+                """, (pid, aid, vista, data_foto, foto['chave'], foto['tipo_mime'], foto['tamanho'], foto['largura'], foto['altura']))
+                movidas += 1
+            cur.execute("UPDATE avaliacao_postural SET foto_frontal = NULL, foto_posterior = NULL, foto_lat_dir = NULL, foto_lat_esq = NULL WHERE id = %s", (aid,))
+            conn.commit()
+        except (ValueError, binascii.Error) as e:
+            conn.rollback()
+            print(f"avaliacao_postural {aid}: {e} (mantida no banco)")
+    _executor_miniaturas().shutdown(wait=True)
+    print(f"{movidas} foto(s) movida(s) para {FOTOS_DIR}.")
+    if movidas: print("Rode VACUUM FULL avaliacao_postural numa janela calma para devolver o espaço ao disco.")
+
+# ==========================================
+# IMPORTAÇÃO EM MASSA (CSV)
+# ==========================================
+# Migração de outro sistema: o CSV é lido linha a linha, cada linha validada em Python, as válidas
+# vão por COPY para uma tabela temporária e o merge (duplicados, resolução de paciente, INSERT final)
+# roda numa transação só. A resposta traz o relatório de erros por linha do arquivo.
+MAX_ERROS_IMPORTACAO = 500
+
+def _normalizar_coluna(nome):
+    nome = unicodedata.normalize('NFKD', nome or '').encode('ascii', 'ignore').decode().lower().strip()
+    return re.sub(r'[^a-z0-9]+', '_', nome).strip('_')
+
+def _data_br(v):
+    for fmt in ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%y'):
+        try: return datetime.strptime(v, fmt).date()
+        except ValueError: pass
+    raise ValueError(f"data inválida '{v}' (use DD/MM/AAAA)")
+
+def _data_hora_br(v):
+    for fmt in ('%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try: return datetime.strptime(v, fmt)
+        except ValueError: pass
+    raise ValueError(f"data/hora inválida '{v}' (use DD/MM/AAAA HH:MM)")
+
+def _cpf(v):
+    d = re.sub(r'\D', '', v)
+    if len(d) != 11 or d == d[0] * 11: raise ValueError(f"CPF inválido '{v}'")
+    for n in (9, 10):
+        if sum(int(d[i]) * (n + 1 - i) for i in range(n)) * 10 % 11 % 10 != int(d[n]): raise ValueError(f"CPF inválido '{v}'")
+    return f"{d[:3]}.{d[3:6]}.{d[6:9]}-{d[9:]}"
+
+def _valor_br(v):
+    original = v
+    v = v.replace('R$', '').replace(' ', '')
+    if ',' in v:
+        if not re.fullmatch(r'[-+]?(\d{1,3}(\.\d{3})+|\d+),\d+', v): raise ValueError(f"valor ambíguo '{original}' (use 1.234,56)")
+        v = v.replace('.', '').replace(',', '.')  # 1.234,56
+    elif re.fullmatch(r'[-+]?\d{1,3}(\.\d{3})+', v): v = v.replace('.', '')  # 2.500 / 1.234.567 (milhar, sem centavos)
+    elif '.' in v and not re.fullmatch(r'[-+]?\d+\.\d{1,2}', v): raise ValueError(f"valor ambíguo '{original}' (use 1.234,56)")
+    try: valor = Decimal(v)
+    except ArithmeticError: raise ValueError(f"valor inválido '{original}'")
+    if not valor.is_finite() or abs(valor) >= 10 ** 8: raise ValueError(f"valor inválido '{original}'")
+    # Nunca arredonda em silêncio: valor do livro-caixa entra exatamente como está no arquivo
+    if valor.as_tuple().exponent < -2: raise ValueError(f"valor com mais de 2 casas decimais '{original}'")
+    return valor.quantize(Decimal('0.01'))
+
+def _campo(linha, erros, campo, conversor=str, obrigatorio=False):
+    v = (linha.get(campo) or '').strip()
+    if not v:
+        if obrigatorio: erros.append(f"{campo}: obrigatório")
+        return None
+    try: return conversor(v)
+    except ValueError as e:
+        erros.append(f"{campo}: {e}")
+        return None
+
+def _validar_paciente(l, erros, vistos, n):
+    nome = _campo(l, erros, 'nome', obrigatorio=True)
+    nasc = _campo(l, erros, 'data_nascimento', _data_br)
+    cpf = _campo(l, erros, 'cpf', _cpf)
+    if nasc and not date(1900, 1, 1) <= nasc <= date.today(): erros.append("data_nascimento: fora do intervalo")
+    chave = cpf or (nome and (_normalizar_coluna(nome), nasc))
+    if chave and chave in vistos: erros.append(f"duplicado no arquivo (linha {vistos[chave]})")
+    elif chave: vistos[chave] = n
+    return (nome, nasc, _campo(l, erros, 'telefone'), cpf, _campo(l, erros, 'endereco'))
+
+def _validar_agendamento(l, erros, vistos, n):
+    paciente_id = _campo(l, erros, 'paciente_id', int)
+    paciente_cpf = _campo(l, erros, 'paciente_cpf', _cpf)
+    paciente_nome = _campo(l, erros, 'paciente_nome')
+    if not (paciente_id or paciente_cpf or paciente_nome): erros.append("paciente: informe paciente_id, cpf ou nome")
+    if l.get('inicio'): inicio = _campo(l, erros, 'inicio', _data_hora_br)
+    else: inicio = _campo(l, erros, 'data', lambda v: _data_hora_br(f"{v} {(l.get('hora') or '').strip()}"), obrigatorio=True)
+    fim = _campo(l, erros, 'fim', _data_hora_br)
+    duracao = _campo(l, erros, 'duracao', int)
+    if inicio and not fim: fim = inicio + (timedelta(minutes=duracao) if duracao else DURACAO_SESSAO)
+    if inicio and fim and fim <= inicio: erros.append("fim: deve ser depois do início")
+    status = _campo(l, erros, 'status') or 'Agendado'
+    status = next((s for s in CORES_STATUS if s.lower() == status.lower()), status)
+    if status not in CORES_STATUS: erros.append(f"status: use {', '.join(CORES_STATUS)}")
+    return (paciente_id, paciente_cpf, paciente_nome, inicio, fim, status, _campo(l, erros, 'obs'))
+
+def _validar_lancamento(l, erros, vistos, n):
+    data_l = _campo(l, erros, 'data', _data_br, obrigatorio=True)
+    valor = _campo(l, erros, 'valor', _valor_br, obrigatorio=True)
+    tipo = _normalizar_coluna(_campo(l, erros, 'tipo') or '')
+    tipo = {'entrada': 'entrada', 'receita': 'entrada', 'credito': 'entrada', 'saida': 'saida', 'despesa': 'saida', 'debito': 'saida'}.get(tipo)
+    if valor is not None and tipo is None: tipo = 'saida' if valor < 0 else 'entrada'
+    if valor is not None: valor = abs(valor)
+    return (data_l, _campo(l, erros, 'descricao', obrigatorio=True), valor, tipo, _campo(l, erros, 'categoria'))
+
+# Por tipo: apelidos de coluna aceitos, validação da linha, tabela de staging e o merge em SQL.
+# "rejeitar" devolve (linha, motivo) das linhas que não entram; o resto vai pelo "inserir".
+IMPORTACOES = {
+    'pacientes': {
+        'apelidos': {'nascimento': 'data_nascimento', 'dt_nascimento': 'data_nascimento', 'data_de_nascimento': 'data_nascimento',
+                     'celular': 'telefone', 'fone': 'telefone', 'nome_completo': 'nome', 'paciente': 'nome'},
+        'validar': _validar_paciente,
+        'staging': "linha INTEGER, nome TEXT, data_nascimento DATE, telefone TEXT, cpf TEXT, endereco TEXT",
+        'preparar': [],
+        'rejeitar': r"""
+            SELECT s.linha, 'CPF já cadastrado (paciente #' || p.id || ')' FROM importacao s
+            JOIN pacientes p ON regexp_replace(p.cpf, '\D', '', 'g') = regexp_replace(s.cpf, '\D', '', 'g') WHERE s.cpf IS NOT NULL
+            UNION ALL
+            SELECT s.linha, 'já cadastrado com mesmo nome e nascimento (paciente #' || p.id || ')' FROM importacao s
+            JOIN pacientes p ON normalizar_busca(p.nome) COLLATE "C" = normalizar_busca(s.nome) AND p.data_nascimento IS NOT DISTINCT FROM s.data_nascimento
+            WHERE s.cpf IS NULL""",
+        'inserir': "INSERT INTO pacientes (nome, data_nascimento, telefone, cpf, endereco) SELECT nome, data_nascimento, telefone, cpf, endereco FROM importacao ORDER BY linha",
+    },
+    'agendamentos': {
+        'apelidos': {'paciente': 'paciente_nome', 'nome': 'paciente_nome', 'nome_paciente': 'paciente_nome', 'cpf': 'paciente_cpf',
+                     'id_paciente': 'paciente_id', 'start': 'inicio', 'start_time': 'inicio', 'end': 'fim', 'end_time': 'fim',
+                     'observacao': 'obs', 'observacoes': 'obs', 'duracao_min': 'duracao'},
+        'validar': _validar_agendamento,
+        'staging': "linha INTEGER, paciente_id INTEGER, paciente_cpf TEXT, paciente_nome TEXT, inicio TIMESTAMP, fim TIMESTAMP, status TEXT, obs TEXT",
+        'preparar': [
+            r"""UPDATE importacao s SET paciente_id = p.id FROM pacientes p
+                WHERE s.paciente_id IS NULL AND s.paciente_cpf IS NOT NULL AND regexp_replace(p.cpf, '\D', '', 'g') = regexp_replace(s.paciente_cpf, '\D', '', 'g')""",
+            # Nome só resolve quando há exatamente um cadastro com ele (cada nome distinto desce uma vez no índice)
+            """UPDATE importacao s SET paciente_id = u.id FROM (
+                   SELECT i.chave, MIN(p.id) AS id
+                   FROM (SELECT DISTINCT normalizar_busca(paciente_nome) AS chave FROM importacao
+                         WHERE paciente_id IS NULL AND paciente_cpf IS NULL AND paciente_nome IS NOT NULL) i
+                   JOIN pacientes p ON normalizar_busca(p.nome) COLLATE "C" = i.chave COLLATE "C"
+                   GROUP BY i.chave HAVING COUNT(*) = 1) u
+               WHERE s.paciente_id IS NULL AND s.paciente_cpf IS NULL AND normalizar_busca(s.paciente_nome) = u.chave""",
+        ],
+        'rejeitar': """
+            SELECT s.linha, 'paciente não encontrado (ou nome com mais de um cadastro)' FROM importacao s
+            WHERE NOT EXISTS (SELECT 1 FROM pacientes p WHERE p.id = s.paciente_id)
+            UNION ALL
+            SELECT s.linha, 'agendamento já existe (#' || a.id || ')' FROM importacao s
+            JOIN agendamentos a ON a.paciente_id = s.paciente_id AND a.start_time = s.inicio""",
+        'inserir': "INSERT INTO agendamentos (paciente_id, start_time, end_time, obs, status) SELECT paciente_id, inicio, fim, obs, status FROM importacao ORDER BY linha",
+    },
+    'financeiro': {
+        'apelidos': {'historico': 'descricao', 'descricao_do_lancamento': 'descricao', 'data_lancamento': 'data', 'valor_r': 'valor', 'natureza': 'tipo'},
+        'validar': _validar_lancamento,
+        'staging': "linha INTEGER, data DATE, descricao TEXT, valor NUMERIC(10, 2), tipo VARCHAR(10), categoria TEXT",
+        'preparar': [],
+        'rejeitar': """
+            SELECT s.linha, 'lançamento já existe (#' || f.id || ')' FROM importacao s
+            JOIN financeiro f ON f.data = s.data AND f.valor = s.valor AND f.tipo = s.tipo AND f.descricao = s.descricao""",
+        'inserir': "INSERT INTO financeiro (data, descricao, valor, tipo, categoria) SELECT data, descricao, valor, tipo, categoria FROM importacao ORDER BY linha",
+    },
+}
+
+def _codificacao_csv(arquivo):
+    # UTF-8 estrito; se não for, o padrão do Excel em português (cp1252). Nunca grava caractere de substituição
+    for codificacao in ('utf-8-sig', 'cp1252'):
+        arquivo.seek(0)
+        decodificador = codecs.getincrementaldecoder(codificacao)()
+        try:
+            for bloco in iter(lambda: arquivo.read(65536), b''): decodificador.decode(bloco)
+            decodificador.decode(b'', final=True)
+        except UnicodeDecodeError: continue
+        arquivo.seek(0)
+        return codificacao
+    raise ValueError("Codificação do arquivo não reconhecida: salve o CSV como UTF-8")
+
+def _ler_csv(arquivo):
+    # Lê o upload em fluxo; separador ; ou , detectado pelo cabeçalho, BOM do Excel ignorado
+    texto = io.TextIOWrapper(arquivo, encoding=_codificacao_csv(arquivo), newline='')
+    cabecalho = texto.readline()
+    separador = ';' if cabecalho.count(';') >= cabecalho.count(',') else ','
+    colunas = next(csv.reader([cabecalho], delimiter=separador), [])
+    return colunas, csv.reader(texto, delimiter=separador)
+
+@app.route('/api/importar/<tipo>', methods=['POST'])
+def importar(tipo):
+    if not session.get('logged_in'): return jsonify({}), 403
+    config = IMPORTACOES.get(tipo)
+    if not config: return jsonify({'status': 'error', 'msg': f"Tipo deve ser {', '.join(IMPORTACOES)}"}), 404
+    if 'arquivo' not in request.files: return jsonify({'status': 'error', 'msg': 'Envie o CSV no campo "arquivo"'}), 400
+    simular = request.args.get('simular') in ('1', 'true')
+
+    try: colunas, leitor = _ler_csv(request.files['arquivo'].stream)
+    except ValueError as e: return jsonify({'status': 'error', 'msg': str(e)}), 400
+    colunas = [config['apelidos'].get(_normalizar_coluna(c), _normalizar_coluna(c)) for c in colunas]
+    erros, vistos, total = [], {}, 0
+    staging = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode='w+', newline='')
+    escritor = csv.writer(staging)
+    for n, valores in enumerate(leitor, 2):  # linha 1 é o cabeçalho
+        if not any(v.strip() for v in valores): continue
+        total += 1
+        erros_linha = []
+        registro = config['validar'](dict(zip(colunas, valores)), erros_linha, vistos, n)
+        if erros_linha: erros.append({'linha': n, 'erros': erros_linha})
+        else: escritor.writerow([n] + [v.isoformat() if isinstance(v, (date, datetime)) else v for v in registro])
+    staging.seek(0)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"CREATE TEMP TABLE importacao ({config['staging']}) ON COMMIT DROP")
+        cur.copy_expert("COPY importacao FROM STDIN WITH (FORMAT csv)", staging)
+        cur.execute("ANALYZE importacao")  # tabela temporária não passa pelo autovacuum; sem isso o planner chuta 1 linha
+        for sql in config['preparar']: cur.execute(sql)
+        cur.execute(config['rejeitar'])
+        rejeitadas = {}
+        for linha, motivo in cur.fetchall():
+            if motivo not in rejeitadas.setdefault(linha, []): rejeitadas[linha].append(motivo)
+        if rejeitadas: cur.execute("DELETE FROM importacao WHERE linha = ANY(%s)", (list(rejeitadas),))
+        cur.execute(config['inserir'])
+        importadas = cur.rowcount
+        if simular: conn.rollback()
+        else: conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'status': 'error', 'msg': str(e)}), 500
+    finally:
+        staging.close()
+
+    erros += [{'linha': n, 'erros': m} for n, m in rejeitadas.items()]
+    erros.sort(key=lambda e: e['linha'])
+    return jsonify({'status': 'success', 'simulado': simular, 'tipo': tipo, 'linhas': total, 'importadas': importadas,
+                    'rejeitadas': len(erros), 'erros': erros[:MAX_ERROS_IMPORTACAO]})
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
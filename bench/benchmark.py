@@ -0,0 +1,320 @@
+"""Benchmark das rotas do FisioManager contra um Postgres local.
+
+Sobe um Postgres descartável (initdb/pg_ctl no PATH) ou usa --dsn, aplica as migrações, gera uma
+clínica sintética e mede as rotas reais pelo test client do Flask e por um gunicorn com vários workers.
+
+    python bench/benchmark.py                               # escala padrão, os dois modos
+    python bench/benchmark.py --pacientes 20000 --anos 5 --modos test_client
+    python bench/benchmark.py --dsn "host=localhost dbname=fisio_bench user=postgres"
+    python bench/benchmark.py --comparar bench/resultados/abc1234.json --limite-regressao 20
+
+O resultado (p50/p95/p99, req/s e consultas SQL por rota) vai para bench/resultados/<commit>.json.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import dados_sinteticos  # noqa: E402
+
+SENHA = 'bench'
+
+
+# ==========================================
+# POSTGRES
+# ==========================================
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class PostgresTemporario:
+    # Cluster novo num diretório temporário, só com socket unix; apagado no fim
+    def __enter__(self):
+        if not shutil.which('initdb') or not shutil.which('pg_ctl'):
+            sys.exit("initdb/pg_ctl não encontrados no PATH: instale o PostgreSQL ou use --dsn")
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            sys.exit("initdb não roda como root: execute com um usuário comum ou use --dsn")
+        self.dir = tempfile.mkdtemp(prefix='fisio_bench_')
+        self.porta = _porta_livre()
+        dados = os.path.join(self.dir, 'dados')
+        subprocess.run(['initdb', '-D', dados, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8'], check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(['pg_ctl', '-D', dados, '-w', '-l', os.path.join(self.dir, 'postgres.log'), '-o',
+                        f"-k {self.dir} -p {self.porta} -c listen_addresses='' -c max_connections=200", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        return {'host': self.dir, 'dbname': 'postgres', 'user': 'postgres', 'password': '', 'port': str(self.porta)}
+
+    def __exit__(self, *exc):
+        subprocess.run(['pg_ctl', '-D', os.path.join(self.dir, 'dados'), '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def _ambiente(dsn):
+    # O app lê a conexão das mesmas variáveis usadas em produção
+    return {'DB_HOST': dsn.get('host', 'localhost'), 'DB_NAME': dsn.get('dbname', 'postgres'), 'DB_USER': dsn.get('user', 'postgres'),
+            'DB_PASS': dsn.get('password', ''), 'DB_PORT': dsn.get('port', '5432'), 'SYS_PASSWORD': SENHA}
+
+
+# ==========================================
+# CENÁRIOS
+# ==========================================
+def _cenarios(amostra):
+    # Cada cenário é (nome, função que sorteia a URL); todos somente leitura para o resultado ser repetível
+    pid = lambda r: r.choice(amostra['pacientes'])
+    def semana(r):
+        dia = amostra['inicio'] + timedelta(days=r.randrange((amostra['fim'] - amostra['inicio']).days - 7))
+        dia -= timedelta(days=dia.weekday())
+        return f"/api/eventos?start={dia:%Y-%m-%dT00:00:00}&end={dia + timedelta(days=7):%Y-%m-%dT00:00:00}"
+    def livres(r):
+        # Só semanas futuras: no passado todos os horários são descartados antes de consultar a agenda
+        hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        dia = hoje + timedelta(days=r.randrange(max(1, (amostra['fim'] - hoje).days - 7)))
+        return f"/api/disponibilidade?start={dia:%Y-%m-%dT00:00:00}&end={dia + timedelta(days=7):%Y-%m-%dT00:00:00}"
+    return [
+        ('dashboard_pagina', lambda r: '/dashboard'),
+        ('dados_dashboard', lambda r: '/api/dados_dashboard'),
+        ('agenda_semana', semana),
+        ('disponibilidade_semana', livres),
+        ('pacientes_pagina', lambda r: '/pacientes'),
+        ('pacientes_lista', lambda r: '/api/pacientes/buscar'),
+        ('pacientes_busca', lambda r: '/api/pacientes/buscar?q=' + urllib.parse.quote(r.choice(amostra['prefixos']))),
+        ('prontuario', lambda r: f"/api/prontuario/{pid(r)}"),
+        ('evolucoes', lambda r: f"/api/evolucoes/{pid(r)}"),
+        ('busca_prontuarios', lambda r: '/api/busca_prontuarios?q=' + urllib.parse.quote(r.choice(amostra['termos']))),
+        ('financeiro_resumo', lambda r: '/api/financeiro/resumo'),
+        ('financeiro_listar', lambda r: '/api/financeiro/listar'),
+        ('tendencias_tc6', lambda r: '/api/tendencias/tc6'),
+    ]
+
+def _amostra(conn, inicio, fim):
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM pacientes ORDER BY id")
+    pacientes = [r[0] for r in cur.fetchall()]
+    cur.execute("SELECT DISTINCT left(nome, 3) FROM pacientes")
+    prefixos = [r[0] for r in cur.fetchall()]
+    if inicio is None:
+        cur.execute("SELECT MIN(start_time), MAX(start_time) FROM agendamentos")
+        inicio, fim = cur.fetchone()
+    conn.rollback()
+    return {'pacientes': pacientes, 'prefixos': prefixos, 'inicio': inicio, 'fim': fim,
+            'termos': ['dor lombar', 'ombro', 'quadríceps', 'cefaleia', 'marcha', 'edema joelho']}
+
+
+# ==========================================
+# MEDIÇÃO
+# ==========================================
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+)')
+
+def _percentil(ordenados, p):
+    # Nearest-rank: menor valor com pelo menos p% das amostras até ele
+    if not ordenados: return None
+    return ordenados[min(len(ordenados) - 1, max(0, math.ceil(p * len(ordenados) / 100) - 1))]
+
+def _resumo(amostras, duracao):
+    # amostras: (latência ms, status, consultas, ms de SQL)
+    lat = sorted(a[0] for a in amostras)
+    sql = [a for a in amostras if a[2] is not None]
+    r = lambda v: round(v, 3) if v is not None else None
+    return {'n': len(amostras), 'p50_ms': r(_percentil(lat, 50)), 'p95_ms': r(_percentil(lat, 95)), 'p99_ms': r(_percentil(lat, 99)),
+            'media_ms': r(sum(lat) / len(lat)), 'max_ms': r(lat[-1]), 'req_s': r(len(amostras) / duracao),
+            'consultas_media': r(sum(a[2] for a in sql) / len(sql)) if sql else None,
+            'sql_ms_media': r(sum(a[3] for a in sql) / len(sql)) if sql else None,
+            'erros': sum(1 for a in amostras if a[1] >= 400)}
+
+def _amostra_resposta(inicio, status, server_timing):
+    m = SERVER_TIMING_DB.search(server_timing or '')
+    return ((time.perf_counter() - inicio) * 1000, status, int(m.group(2)) if m else None, float(m.group(1)) if m else None)
+
+def medir_test_client(fisio, cenarios, args):
+    cliente = fisio.app.test_client()
+    with cliente.session_transaction() as s: s['logged_in'] = True
+    resultados = {}
+    for nome, url in cenarios:
+        r = random.Random(args.semente)
+        for _ in range(args.aquecimento): cliente.get(url(r))
+        amostras, inicio_total = [], time.perf_counter()
+        for _ in range(args.requisicoes):
+            u = url(r)
+            inicio = time.perf_counter()
+            resp = cliente.get(u)
+            resp.get_data()
+            amostras.append(_amostra_resposta(inicio, resp.status_code, resp.headers.get('Server-Timing')))
+        resultados[nome] = _resumo(amostras, time.perf_counter() - inicio_total)
+        _imprimir_linha('test_client', nome, resultados[nome])
+    return resultados
+
+def medir_gunicorn(ambiente, cenarios, args):
+    porta = _porta_livre()
+    base = f"http://127.0.0.1:{porta}"
+    env = dict(os.environ, **ambiente, DB_MIGRAR_NA_INICIALIZACAO='0', DB_POOL_MAX=str(max(args.concorrencia, 10)))
+    proc = subprocess.Popen(['gunicorn', '-c', os.path.join(RAIZ, 'gunicorn.conf.py'), '-k', args.worker_class,
+                             '-w', str(args.workers), '-b', f'127.0.0.1:{porta}', '--chdir', RAIZ,
+                             '--log-level', 'warning', 'app:app'], env=env)
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(base + '/', timeout=1).read()
+                break
+            except OSError: time.sleep(0.1)
+        else: raise RuntimeError("gunicorn não respondeu")
+        # Login de verdade pelo formulário; o cookie de sessão vale para todos os workers
+        cookies = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+        opener.open(base + '/', data=urllib.parse.urlencode({'senha': SENHA}).encode()).read()
+        cookie = '; '.join(f'{c.name}={c.value}' for c in cookies)
+
+        def chamar(u):
+            inicio = time.perf_counter()
+            req = urllib.request.Request(base + u, headers={'Cookie': cookie, 'Accept-Encoding': 'gzip'})
+            try:
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    resp.read()
+                    return _amostra_resposta(inicio, resp.status, resp.headers.get('Server-Timing'))
+            except urllib.error.HTTPError as e:
+                return _amostra_resposta(inicio, e.code, e.headers.get('Server-Timing'))
+
+        resultados = {}
+        with ThreadPoolExecutor(args.concorrencia) as executor:
+            for nome, url in cenarios:
+                r = random.Random(args.semente)
+                list(executor.map(chamar, [url(r) for _ in range(args.aquecimento * args.workers)]))
+                urls = [url(r) for _ in range(args.requisicoes)]
+                inicio_total = time.perf_counter()
+                amostras = list(executor.map(chamar, urls))
+                resultados[nome] = _resumo(amostras, time.perf_counter() - inicio_total)
+                _imprimir_linha('gunicorn', nome, resultados[nome])
+        return resultados
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+# ==========================================
+# RELATÓRIO
+# ==========================================
+def _imprimir_linha(modo, nome, r):
+    consultas = f"{r['consultas_media']:.1f}" if r['consultas_media'] is not None else '-'
+    print(f"{modo:<12} {nome:<20} p50 {r['p50_ms']:8.2f}  p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f} ms  "
+          f"{r['req_s']:8.1f} req/s  {consultas:>5} SQL  {r['erros']} erros", flush=True)
+
+def _commit():
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+        sujo = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=RAIZ, capture_output=True, text=True).stdout.strip()
+        return sha + ('-sujo' if sujo else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'sem-git'
+
+def comparar(atual, arquivo_base, limite):
+    with open(arquivo_base, encoding='utf-8') as f: base = json.load(f)
+    print(f"\nComparação com {base['meta']['commit']} (p95, consultas SQL por requisição):")
+    regressoes = []
+    for modo, rotas in atual['resultados'].items():
+        for nome, r in rotas.items():
+            antes = base['resultados'].get(modo, {}).get(nome)
+            if not antes: continue
+            delta = (r['p95_ms'] - antes['p95_ms']) / antes['p95_ms'] * 100 if antes['p95_ms'] else 0.0
+            print(f"{modo:<12} {nome:<20} {antes['p95_ms']:8.2f} -> {r['p95_ms']:8.2f} ms ({delta:+6.1f}%)  "
+                  f"SQL {antes.get('consultas_media')} -> {r.get('consultas_media')}")
+            if limite is not None and delta > limite: regressoes.append(f"{modo}/{nome}")
+    if regressoes:
+        print(f"\nRegressão acima de {limite}% no p95: {', '.join(regressoes)}")
+        return 1
+    return 0
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--dsn', help='Banco existente (libpq). Sem isso sobe um Postgres temporário.')
+    ap.add_argument('--pacientes', type=int, default=2000)
+    ap.add_argument('--anos', type=int, default=3, help='Anos de histórico de agenda/financeiro/prontuário')
+    ap.add_argument('--sessoes-mes', type=int, default=800)
+    ap.add_argument('--lancamentos-mes', type=int, default=120)
+    ap.add_argument('--evolucoes-paciente', type=int, default=8)
+    ap.add_argument('--avaliacoes-paciente', type=int, default=2)
+    ap.add_argument('--semente', type=float, default=0.42)
+    ap.add_argument('--modos', default='test_client,gunicorn')
+    ap.add_argument('--cenarios', help='Lista separada por vírgula (padrão: todos)')
+    ap.add_argument('--requisicoes', type=int, default=200, help='Requisições medidas por cenário')
+    ap.add_argument('--aquecimento', type=int, default=10)
+    ap.add_argument('--workers', type=int, default=4, help='Workers do gunicorn')
+    ap.add_argument('--worker-class', default='gevent', help='Worker do gunicorn (o mesmo do gunicorn.conf.py)')
+    ap.add_argument('--concorrencia', type=int, default=8, help='Clientes simultâneos contra o gunicorn')
+    ap.add_argument('--saida', help='Arquivo JSON (padrão: bench/resultados/<commit>.json)')
+    ap.add_argument('--comparar', help='JSON de uma execução anterior para comparar')
+    ap.add_argument('--limite-regressao', type=float, help='Sai com código 1 se algum p95 piorar mais que este percentual')
+    args = ap.parse_args()
+
+    pg = None if args.dsn else PostgresTemporario()
+    dsn = parse_dsn(args.dsn) if args.dsn else pg.__enter__()
+    try:
+        ambiente = _ambiente(dsn)
+        os.environ.update(ambiente)
+        os.environ['DB_MIGRAR_NA_INICIALIZACAO'] = '0'
+        import app as fisio
+
+        conn = psycopg2.connect(**fisio._dsn())
+        fisio.aplicar_migracoes(conn, log=lambda msg: print(f"[migrações] {msg}"))
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM pacientes")
+        inicio = fim = None
+        if cur.fetchone()[0] == 0:
+            t = time.perf_counter()
+            inicio, fim = dados_sinteticos.gerar(conn, args.pacientes, args.anos, args.sessoes_mes, args.lancamentos_mes,
+                                                 args.evolucoes_paciente, args.avaliacoes_paciente, args.semente,
+                                                 log=lambda msg: print(f"[dados] {msg}"))
+            print(f"[dados] gerados em {time.perf_counter() - t:.1f} s")
+        else:
+            print("[dados] banco já tem pacientes: usando os dados existentes")
+        cur.execute("""SELECT version(), (SELECT COUNT(*) FROM pacientes), (SELECT COUNT(*) FROM agendamentos),
+                              (SELECT COUNT(*) FROM financeiro), (SELECT COUNT(*) FROM evolucoes), (SELECT COUNT(*) FROM avaliacoes_completa)""")
+        versao_pg, *contagens = cur.fetchone()
+        amostra = _amostra(conn, inicio, fim)
+        conn.close()
+
+        cenarios = _cenarios(amostra)
+        if args.cenarios:
+            escolhidos = args.cenarios.split(',')
+            cenarios = [c for c in cenarios if c[0] in escolhidos]
+
+        modos = args.modos.split(',')
+        resultado = {
+            'meta': {'commit': _commit(), 'data': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                     'postgres': versao_pg.split(',')[0], 'cpus': os.cpu_count(), 'escala': {k: getattr(args, k) for k in (
+                         'pacientes', 'anos', 'sessoes_mes', 'lancamentos_mes', 'evolucoes_paciente', 'avaliacoes_paciente', 'semente')},
+                     'dados_gerados': inicio is not None, 'linhas': dict(zip(('pacientes', 'agendamentos', 'financeiro', 'evolucoes', 'avaliacoes'), contagens)),
+                     'requisicoes': args.requisicoes, 'workers': args.workers, 'worker_class': args.worker_class, 'concorrencia': args.concorrencia},
+            'resultados': {}
+        }
+        if 'test_client' in modos: resultado['resultados']['test_client'] = medir_test_client(fisio, cenarios, args)
+        if 'gunicorn' in modos: resultado['resultados']['gunicorn'] = medir_gunicorn(ambiente, cenarios, args)
+    finally:
+        if pg: pg.__exit__(None, None, None)
+
+    saida = args.saida or os.path.join(RAIZ, 'bench', 'resultados', f"{resultado['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w', encoding='utf-8') as f: json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultado salvo em {saida}")
+    return comparar(resultado, args.comparar, args.limite_regressao) if args.comparar else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
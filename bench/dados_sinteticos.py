@@ -0,0 +1,113 @@
+# Clínica sintética para o benchmark: tudo gerado no próprio Postgres com generate_series,
+# com setseed() para que a mesma escala produza sempre os mesmos dados.
+
+NOMES = ['Ana', 'Maria', 'João', 'José', 'Antônio', 'Francisca', 'Carlos', 'Paulo', 'Lúcia', 'Pedro',
+         'Márcia', 'Luiz', 'Fernanda', 'Rafael', 'Juliana', 'Marcos', 'Patrícia', 'Gabriel', 'Letícia', 'Éverton']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima', 'Gomes',
+              'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Araújo', 'Melo', 'Barbosa', 'Cardoso', 'Rocha', 'Conceição']
+FRASES = ['Paciente relata melhora da dor lombar.', 'Dor no ombro direito ao elevar o braço.',
+          'Realizado fortalecimento de quadríceps com carga progressiva.', 'Mobilização articular de coluna torácica.',
+          'Alongamento de cadeia posterior, boa tolerância.', 'Queixa de cefaleia tensional após o trabalho.',
+          'Treino de marcha com obstáculos sem intercorrências.', 'Liberação miofascial em trapézio superior.',
+          'Exercícios respiratórios com incentivador.', 'Edema em joelho esquerdo reduzido.',
+          'Paciente faltou à última sessão por viagem.', 'Orientado sobre ergonomia no home office.']
+DIAGNOSTICOS = ['Lombalgia crônica', 'Tendinopatia do manguito rotador', 'Gonartrose', 'Cervicalgia',
+                'Pós-operatório de LCA', 'DPOC', 'Fascite plantar', 'Hérnia de disco lombar']
+CATEGORIAS_ENTRADA = ['Consulta', 'Pacote Pilates', 'Convênio', 'Avaliação']
+CATEGORIAS_SAIDA = ['Aluguel', 'Material', 'Salários', 'Impostos', 'Manutenção']
+APARELHOS = ['Solo', 'Bola', 'Reformer', 'Cadillac', 'Chair', 'Barrel']
+
+
+def _sorteio(coluna):
+    # Elemento aleatório de um array SQL
+    return f"{coluna}[1 + floor(random() * cardinality({coluna}))::int]"
+
+
+def gerar(conn, pacientes=2000, anos=3, sessoes_mes=800, lancamentos_mes=120, evolucoes_paciente=8,
+          avaliacoes_paciente=2, semente=0.42, log=print):
+    cur = conn.cursor()
+    cur.execute("SET max_parallel_workers_per_gather = 0")  # planos paralelos quebram a reprodutibilidade
+    cur.execute("SELECT setseed(%s)", (semente,))
+    cur.execute("SELECT date_trunc('month', LOCALTIMESTAMP) - make_interval(years => %s), date_trunc('month', LOCALTIMESTAMP) + INTERVAL '2 months'", (anos,))
+    inicio, fim = cur.fetchone()
+    meses = anos * 12 + 2
+
+    cur.execute(f"""
+        INSERT INTO pacientes (nome, data_nascimento, telefone, cpf, endereco)
+        SELECT {_sorteio('n')} || ' ' || {_sorteio('s')} || ' ' || {_sorteio('s')},
+               DATE '1940-01-01' + floor(random() * 25000)::int,
+               '(11) 9' || lpad(floor(random() * 1e8)::bigint::text, 8, '0'),
+               lpad(floor(random() * 1e11)::bigint::text, 11, '0'),
+               'Rua ' || {_sorteio('s')} || ', ' || (1 + floor(random() * 2000))::int
+        FROM generate_series(1, %s), (SELECT %s::text[] AS n, %s::text[] AS s) nomes
+    """, (pacientes, NOMES, SOBRENOMES))
+    log(f"pacientes: {cur.rowcount}")
+
+    # Sessões de segunda a sábado, das 07h às 19h; passado com status variados, futuro só Agendado
+    cur.execute(f"""
+        WITH ids AS (SELECT array_agg(id ORDER BY id) AS v FROM pacientes),
+        slots AS (
+            SELECT date_trunc('day', %(inicio)s + random() * (%(fim)s - %(inicio)s)) + make_interval(hours => 7 + floor(random() * 12)::int) AS inicio,
+                   random() AS r
+            FROM generate_series(1, %(total)s))
+        INSERT INTO agendamentos (paciente_id, start_time, end_time, obs, status, atualizado_em)
+        SELECT {_sorteio('v')}, inicio, inicio + INTERVAL '1 hour', '',
+               CASE WHEN inicio > LOCALTIMESTAMP THEN 'Agendado' WHEN r < 0.8 THEN 'Realizado' WHEN r < 0.9 THEN 'Faltou'
+                    WHEN r < 0.95 THEN 'Cancelado' ELSE 'Agendado' END,
+               LEAST(inicio, LOCALTIMESTAMP)
+        FROM slots, ids WHERE extract(dow FROM inicio) <> 0
+    """, {'inicio': inicio, 'fim': fim, 'total': meses * sessoes_mes})
+    log(f"agendamentos: {cur.rowcount}")
+
+    cur.execute(f"""
+        INSERT INTO financeiro (descricao, valor, tipo, categoria, data)
+        SELECT CASE WHEN r < 0.7 THEN 'Recebimento' ELSE 'Pagamento' END || ' #' || g,
+               round((30 + random() * (CASE WHEN r < 0.7 THEN 300 ELSE 2500 END))::numeric, 2),
+               CASE WHEN r < 0.7 THEN 'entrada' ELSE 'saida' END,
+               CASE WHEN r < 0.7 THEN {_sorteio('ce')} ELSE {_sorteio('cs')} END,
+               (%(inicio)s + random() * (LOCALTIMESTAMP - %(inicio)s))::date
+        FROM (SELECT g, random() AS r FROM generate_series(1, %(total)s) g) t,
+             (SELECT %(ce)s::text[] AS ce, %(cs)s::text[] AS cs) c
+    """, {'inicio': inicio, 'total': (meses - 2) * lancamentos_mes, 'ce': CATEGORIAS_ENTRADA, 'cs': CATEGORIAS_SAIDA})
+    log(f"financeiro: {cur.rowcount}")
+
+    cur.execute(f"""
+        WITH ids AS (SELECT array_agg(id ORDER BY id) AS v FROM pacientes)
+        INSERT INTO evolucoes (paciente_id, data, texto)
+        SELECT {_sorteio('v')}, %(inicio)s + random() * (LOCALTIMESTAMP - %(inicio)s),
+               {_sorteio('f')} || ' ' || {_sorteio('f')} || ' ' || {_sorteio('f')}
+        FROM generate_series(1, %(total)s), ids, (SELECT %(f)s::text[] AS f) frases
+    """, {'inicio': inicio, 'total': pacientes * evolucoes_paciente, 'f': FRASES})
+    log(f"evolucoes: {cur.rowcount}")
+
+    # 40% das avaliações com TC6 (colunas tipadas e a string do formulário antigo)
+    cur.execute(f"""
+        WITH ids AS (SELECT array_agg(id ORDER BY id) AS v FROM pacientes),
+        base AS (
+            SELECT {_sorteio('v')} AS paciente_id, %(inicio)s + random() * (LOCALTIMESTAMP - %(inicio)s) AS data,
+                   {_sorteio('d')} AS diag, {_sorteio('f')} AS queixa, {_sorteio('a')} AS aparelho,
+                   CASE WHEN random() < 0.4 THEN round((200 + random() * 400)::numeric, 1) END AS tc6, round((random() * 10)::numeric) AS borg
+            FROM generate_series(1, %(total)s), ids,
+                 (SELECT %(d)s::text[] AS d, %(f)s::text[] AS f, %(a)s::text[] AS a) listas)
+        INSERT INTO avaliacoes_completa (paciente_id, data_avaliacao, diagnostico_medico, queixa_principal, hma, conduta,
+                                         dados_pilates, dados_quiro, dados_cardio, tc6_distancia, tc6_paradas, tc6_usou_o2,
+                                         tc6_borg_dispneia, tc6_borg_mmii, dados_estruturados)
+        SELECT paciente_id, data, diag, queixa, queixa, 'Cinesioterapia e orientações.',
+               'Aparelhos: ' || aparelho || ' | ', 'Reg:  | Tec:  | ',
+               CASE WHEN tc6 IS NOT NULL THEN 'TC6: ' || tc6 || 'm | Paradas: 0 | O2: Não | Borg Disp: ' || borg || ' | Borg MMII: ' || borg END,
+               tc6, CASE WHEN tc6 IS NOT NULL THEN 0 END, CASE WHEN tc6 IS NOT NULL THEN FALSE END,
+               CASE WHEN tc6 IS NOT NULL THEN borg END, CASE WHEN tc6 IS NOT NULL THEN borg END,
+               jsonb_build_object('cardio', jsonb_build_object('equipamentos', '[]'::jsonb),
+                                  'pilates', jsonb_build_object('aparelhos', jsonb_build_array(aparelho)),
+                                  'quiro', jsonb_build_object('regioes', '[]'::jsonb, 'tecnicas', '[]'::jsonb))
+        FROM base
+    """, {'inicio': inicio, 'total': pacientes * avaliacoes_paciente, 'd': DIAGNOSTICOS, 'f': FRASES, 'a': APARELHOS})
+    log(f"avaliacoes: {cur.rowcount}")
+
+    conn.commit()
+    conn.autocommit = True
+    for tabela in ('pacientes', 'agendamentos', 'financeiro', 'evolucoes', 'avaliacoes_completa',
+                   'resumo_mensal_sessoes', 'resumo_mensal_financeiro'):
+        cur.execute(f"VACUUM ANALYZE {tabela}")
+    conn.autocommit = False
+    return inicio, fim
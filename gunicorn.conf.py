@@ -0,0 +1,19 @@
+# Configuração do gunicorn (lida automaticamente quando ele roda na raiz do projeto).
+# Worker gevent por padrão: cada tela da agenda mantém um SSE aberto (/api/agenda/stream) e,
+# com o worker sync, cada tela prenderia um worker inteiro.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = 30
+keepalive = 5
+
+
+def post_fork(server, worker):
+    # O psycopg2 é C: sem o psycogreen uma consulta lenta travaria todas as greenlets do worker
+    # worker_class_str é o que está rodando de fato (-k na linha de comando vence este arquivo)
+    if server.cfg.worker_class_str == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,46 @@
+-- Esquema base do FisioManager (o que antes era criado à mão + passos 1-6 do /reparar_banco).
+-- Tudo com IF NOT EXISTS: num banco que já existia esta migração só registra a versão.
+CREATE TABLE IF NOT EXISTS pacientes (
+    id SERIAL PRIMARY KEY,
+    nome TEXT NOT NULL,
+    data_nascimento DATE,
+    telefone TEXT,
+    cpf TEXT,
+    endereco TEXT);
+
+CREATE TABLE IF NOT EXISTS agendamentos (
+    id SERIAL PRIMARY KEY,
+    paciente_id INTEGER REFERENCES pacientes(id) ON DELETE CASCADE,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP NOT NULL,
+    obs TEXT);
+ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'Agendado';
+
+CREATE TABLE IF NOT EXISTS financeiro (
+    id SERIAL PRIMARY KEY,
+    descricao TEXT NOT NULL,
+    valor NUMERIC(10, 2) NOT NULL,
+    tipo VARCHAR(10) NOT NULL,
+    categoria TEXT,
+    data DATE DEFAULT CURRENT_DATE);
+
+CREATE TABLE IF NOT EXISTS evolucoes (
+    id SERIAL PRIMARY KEY, paciente_id INTEGER REFERENCES pacientes(id) ON DELETE CASCADE,
+    data TIMESTAMP DEFAULT CURRENT_TIMESTAMP, texto TEXT);
+
+CREATE TABLE IF NOT EXISTS avaliacoes_completa (
+    id SERIAL PRIMARY KEY, paciente_id INTEGER REFERENCES pacientes(id) ON DELETE CASCADE,
+    data_avaliacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ocupacao TEXT, lateralidade TEXT, diagnostico_medico TEXT, queixa_principal TEXT,
+    hma TEXT, hpp TEXT, habitos TEXT, sinais_vitais TEXT, avaliacao_dor TEXT,
+    inspecao TEXT, palpacao TEXT, adm TEXT, forca_muscular TEXT, neuro TEXT,
+    testes_especiais TEXT, diagnostico_cif TEXT, objetivos TEXT, conduta TEXT);
+ALTER TABLE avaliacoes_completa ADD COLUMN IF NOT EXISTS dados_pilates TEXT;
+ALTER TABLE avaliacoes_completa ADD COLUMN IF NOT EXISTS dados_quiro TEXT;
+ALTER TABLE avaliacoes_completa ADD COLUMN IF NOT EXISTS dados_cardio TEXT;
+
+CREATE TABLE IF NOT EXISTS avaliacao_postural (
+    id SERIAL PRIMARY KEY, paciente_id INTEGER REFERENCES pacientes(id) ON DELETE CASCADE,
+    data_foto TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    foto_frontal TEXT, foto_posterior TEXT, foto_lat_dir TEXT, foto_lat_esq TEXT,
+    analise_ia TEXT);
@@ -0,0 +1,6 @@
+-- Feed incremental da Agenda (alterações desde o último fetch + lápides dos removidos) e séries recorrentes
+ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP DEFAULT NOW();
+ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS serie_id UUID;
+CREATE TABLE IF NOT EXISTS agendamentos_removidos (
+    id INTEGER PRIMARY KEY, removido_em TIMESTAMP DEFAULT NOW());
+CREATE INDEX IF NOT EXISTS idx_agendamentos_removidos_em ON agendamentos_removidos (removido_em);
@@ -0,0 +1,60 @@
+-- Resumos mensais do Dashboard: uma linha por (mês, paciente, status) e por (mês, tipo),
+-- mantidas por trigger a cada INSERT/UPDATE/DELETE nas tabelas de origem.
+CREATE TABLE IF NOT EXISTS resumo_mensal_sessoes (
+    mes DATE NOT NULL, paciente_id INTEGER NOT NULL, status TEXT NOT NULL, qtd INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (mes, status, paciente_id));
+CREATE TABLE IF NOT EXISTS resumo_mensal_financeiro (
+    mes DATE NOT NULL, tipo VARCHAR(10) NOT NULL, total NUMERIC(14, 2) NOT NULL DEFAULT 0, qtd INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (mes, tipo));
+
+CREATE OR REPLACE FUNCTION resumo_agendamentos_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.paciente_id IS NOT DISTINCT FROM NEW.paciente_id
+       AND date_trunc('month', OLD.start_time) = date_trunc('month', NEW.start_time)
+       AND COALESCE(OLD.status, 'Agendado') = COALESCE(NEW.status, 'Agendado') THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE resumo_mensal_sessoes SET qtd = qtd - 1
+         WHERE mes = date_trunc('month', OLD.start_time)::date AND status = COALESCE(OLD.status, 'Agendado') AND paciente_id = OLD.paciente_id;
+        DELETE FROM resumo_mensal_sessoes
+         WHERE mes = date_trunc('month', OLD.start_time)::date AND status = COALESCE(OLD.status, 'Agendado') AND paciente_id = OLD.paciente_id AND qtd <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO resumo_mensal_sessoes (mes, status, paciente_id, qtd)
+        VALUES (date_trunc('month', NEW.start_time)::date, COALESCE(NEW.status, 'Agendado'), NEW.paciente_id, 1)
+        ON CONFLICT (mes, status, paciente_id) DO UPDATE SET qtd = resumo_mensal_sessoes.qtd + 1;
+    END IF;
+    RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION resumo_financeiro_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE resumo_mensal_financeiro SET total = total - OLD.valor, qtd = qtd - 1
+         WHERE mes = date_trunc('month', OLD.data)::date AND tipo = OLD.tipo;
+        DELETE FROM resumo_mensal_financeiro WHERE mes = date_trunc('month', OLD.data)::date AND tipo = OLD.tipo AND qtd <= 0;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO resumo_mensal_financeiro (mes, tipo, total, qtd)
+        VALUES (date_trunc('month', NEW.data)::date, NEW.tipo, NEW.valor, 1)
+        ON CONFLICT (mes, tipo) DO UPDATE SET total = resumo_mensal_financeiro.total + EXCLUDED.total, qtd = resumo_mensal_financeiro.qtd + 1;
+    END IF;
+    RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_resumo_agendamentos ON agendamentos;
+CREATE TRIGGER trg_resumo_agendamentos AFTER INSERT OR DELETE OR UPDATE OF start_time, status, paciente_id
+    ON agendamentos FOR EACH ROW EXECUTE FUNCTION resumo_agendamentos_trg();
+DROP TRIGGER IF EXISTS trg_resumo_financeiro ON financeiro;
+CREATE TRIGGER trg_resumo_financeiro AFTER INSERT OR DELETE OR UPDATE OF valor, tipo, data
+    ON financeiro FOR EACH ROW EXECUTE FUNCTION resumo_financeiro_trg();
+
+-- Carga inicial (mesma conta do `flask reconstruir-resumos`)
+LOCK TABLE agendamentos, financeiro IN SHARE MODE;
+TRUNCATE resumo_mensal_sessoes, resumo_mensal_financeiro;
+INSERT INTO resumo_mensal_sessoes (mes, status, paciente_id, qtd)
+SELECT date_trunc('month', start_time)::date, COALESCE(status, 'Agendado'), paciente_id, COUNT(*)
+FROM agendamentos GROUP BY 1, 2, 3;
+INSERT INTO resumo_mensal_financeiro (mes, tipo, total, qtd)
+SELECT date_trunc('month', data)::date, tipo, SUM(valor), COUNT(*) FROM financeiro GROUP BY 1, 2;
@@ -0,0 +1,4 @@
+-- Busca de pacientes por prefixo sem acento (os índices ficam na 0007, criados sem travar a tabela)
+CREATE OR REPLACE FUNCTION normalizar_busca(t TEXT) RETURNS TEXT AS $$
+    SELECT translate(lower(t), 'áàâãäéèêëíìîïóòôõöúùûüçñ', 'aaaaaeeeeiiiiooooouuuuucn')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
@@ -0,0 +1,16 @@
+-- tsvector da busca nos prontuários (stemming em português), calculado por função em vez de coluna
+-- gerada: nada de reescrever as tabelas sob ACCESS EXCLUSIVE. Os índices GIN de expressão ficam na
+-- 0007 (CONCURRENTLY) e as consultas chamam as mesmas funções para casar com eles.
+CREATE OR REPLACE FUNCTION busca_evolucao(texto TEXT) RETURNS tsvector AS $$
+    SELECT to_tsvector('portuguese'::regconfig, COALESCE(texto, ''))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Na avaliação, diagnóstico e queixa pesam mais que o resto do texto
+CREATE OR REPLACE FUNCTION busca_avaliacao(diagnostico_medico TEXT, queixa_principal TEXT, hma TEXT, hpp TEXT, diagnostico_cif TEXT,
+                                           ocupacao TEXT, avaliacao_dor TEXT, inspecao TEXT, adm TEXT, testes_especiais TEXT,
+                                           objetivos TEXT, conduta TEXT) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('portuguese'::regconfig, COALESCE(diagnostico_medico, '') || ' ' || COALESCE(queixa_principal, '')), 'A') ||
+           setweight(to_tsvector('portuguese'::regconfig, COALESCE(hma, '') || ' ' || COALESCE(hpp, '') || ' ' || COALESCE(diagnostico_cif, '')), 'B') ||
+           setweight(to_tsvector('portuguese'::regconfig, COALESCE(ocupacao, '') || ' ' || COALESCE(avaliacao_dor, '') || ' ' || COALESCE(inspecao, '') || ' ' ||
+                     COALESCE(adm, '') || ' ' || COALESCE(testes_especiais, '') || ' ' || COALESCE(objetivos, '') || ' ' || COALESCE(conduta, '')), 'C')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
@@ -0,0 +1,46 @@
+-- Dados do TC6 em colunas numéricas; aparelhos/regiões/técnicas em JSONB (índices na 0007).
+-- O texto livre (dados_cardio/pilates/quiro) continua gravado para exibição.
+ALTER TABLE avaliacoes_completa
+    ADD COLUMN IF NOT EXISTS tc6_distancia NUMERIC(6, 1),
+    ADD COLUMN IF NOT EXISTS tc6_paradas SMALLINT,
+    ADD COLUMN IF NOT EXISTS tc6_usou_o2 BOOLEAN,
+    ADD COLUMN IF NOT EXISTS tc6_o2_litros NUMERIC(4, 1),
+    ADD COLUMN IF NOT EXISTS tc6_borg_dispneia NUMERIC(3, 1),
+    ADD COLUMN IF NOT EXISTS tc6_borg_mmii NUMERIC(3, 1),
+    ADD COLUMN IF NOT EXISTS dados_estruturados JSONB;
+
+-- Parsers das strings "TC6: 420m | Paradas: 1 | O2: 2L | ..." gravadas pelo formulário antigo
+CREATE OR REPLACE FUNCTION extrair_numero(t TEXT, padrao TEXT) RETURNS NUMERIC AS $$
+    SELECT NULLIF(replace(substring(t FROM padrao), ',', '.'), '')::numeric
+$$ LANGUAGE sql IMMUTABLE;
+-- Valor fora da faixa (digitação: Borg 100, TC6 de 40000 m) vira NULL em vez de estourar a coluna
+-- e abortar a migração; o texto original continua em dados_cardio
+CREATE OR REPLACE FUNCTION extrair_numero(t TEXT, padrao TEXT, maximo NUMERIC) RETURNS NUMERIC AS $$
+    SELECT CASE WHEN n <= maximo THEN n END FROM (SELECT extrair_numero(t, padrao) AS n) x
+$$ LANGUAGE sql IMMUTABLE;
+CREATE OR REPLACE FUNCTION extrair_texto(t TEXT, padrao TEXT) RETURNS TEXT AS $$
+    SELECT NULLIF(trim(substring(t FROM padrao)), '')
+$$ LANGUAGE sql IMMUTABLE;
+CREATE OR REPLACE FUNCTION extrair_lista(t TEXT, padrao TEXT) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_agg(trim(x)) FILTER (WHERE trim(x) <> ''), '[]'::jsonb)
+    FROM unnest(string_to_array(substring(t FROM padrao), ',')) AS x
+$$ LANGUAGE sql IMMUTABLE;
+
+UPDATE avaliacoes_completa SET
+    tc6_distancia = extrair_numero(dados_cardio, 'TC6: *([0-9]+(?:[.,][0-9]+)?) *m', 2000),
+    tc6_paradas = extrair_numero(dados_cardio, 'Paradas: *([0-9]+)', 100)::smallint,
+    tc6_usou_o2 = CASE WHEN dados_cardio ~ 'O2: *Não' THEN FALSE WHEN dados_cardio ~ 'O2: *[0-9.,]*L' THEN TRUE END,
+    tc6_o2_litros = extrair_numero(dados_cardio, 'O2: *([0-9]+(?:[.,][0-9]+)?) *L', 15),
+    tc6_borg_dispneia = extrair_numero(dados_cardio, 'Borg Disp: *([0-9]+(?:[.,][0-9]+)?)', 10),
+    tc6_borg_mmii = extrair_numero(dados_cardio, 'Borg MMII: *([0-9]+(?:[.,][0-9]+)?)', 10),
+    dados_estruturados = jsonb_build_object(
+        'cardio', jsonb_strip_nulls(jsonb_build_object(
+            'sinais', extrair_texto(dados_cardio, 'Sinais: *([^|]*)'),
+            'mrc', extrair_texto(dados_cardio, 'MRC: *([^|]*)'),
+            'espirometria', extrair_texto(dados_cardio, 'Espiro: *([^|]*)'),
+            'equipamentos', extrair_lista(dados_cardio, 'Eq: *([^|]*)'))),
+        'pilates', jsonb_build_object('aparelhos', extrair_lista(dados_pilates, '^Aparelhos: *([^|]*)')),
+        'quiro', jsonb_build_object(
+            'regioes', extrair_lista(dados_quiro, '^Reg: *([^|]*)'),
+            'tecnicas', extrair_lista(dados_quiro, 'Tec: *([^|]*)')))
+WHERE dados_estruturados IS NULL;
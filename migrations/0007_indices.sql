@@ -0,0 +1,38 @@
+-- migracao: sem-transacao
+-- Índices das consultas quentes, criados com CONCURRENTLY para não travar escrita em produção.
+-- Roda fora de transação, um comando por vez; se cair no meio, o índice inválido é descartado
+-- e recriado na próxima execução.
+
+-- Agenda: janela visível, feed incremental, histórico do paciente e séries
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_agendamentos_periodo ON agendamentos (start_time, end_time);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_agendamentos_atualizado ON agendamentos (atualizado_em);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_agendamentos_paciente ON agendamentos (paciente_id, start_time);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_agendamentos_serie ON agendamentos (serie_id, start_time) WHERE serie_id IS NOT NULL;
+
+-- Prontuário: páginas do histórico (keyset por data, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_evolucoes_paciente_data ON evolucoes (paciente_id, data DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avaliacoes_paciente_data ON avaliacoes_completa (paciente_id, data_avaliacao DESC, id DESC);
+
+-- Financeiro: listagem mais recente primeiro
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_financeiro_data ON financeiro (data DESC, id DESC);
+
+-- Busca de pacientes (nome sem acento, só dígitos no CPF/telefone)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pacientes_nome_busca ON pacientes ((normalizar_busca(nome) COLLATE "C"), id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pacientes_cpf_busca ON pacientes ((regexp_replace(cpf, '\D', '', 'g')) text_pattern_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_pacientes_telefone_busca ON pacientes ((regexp_replace(telefone, '\D', '', 'g')) text_pattern_ops);
+
+-- Busca textual nos prontuários (índices de expressão sobre as funções da 0005)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_evolucoes_busca ON evolucoes USING GIN (busca_evolucao(texto));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avaliacoes_busca ON avaliacoes_completa USING GIN (busca_avaliacao(diagnostico_medico, queixa_principal, hma, hpp, diagnostico_cif,
+    ocupacao, avaliacao_dor, inspecao, adm, testes_especiais, objetivos, conduta));
+
+-- Tendências do TC6 e filtros de coorte
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avaliacoes_tc6 ON avaliacoes_completa (paciente_id, data_avaliacao) WHERE tc6_distancia IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avaliacoes_tc6_data ON avaliacoes_completa (data_avaliacao) WHERE tc6_distancia IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avaliacoes_estruturados ON avaliacoes_completa USING GIN (dados_estruturados jsonb_path_ops);
+
+ANALYZE pacientes;
+ANALYZE agendamentos;
+ANALYZE evolucoes;
+ANALYZE avaliacoes_completa;
+ANALYZE financeiro;
@@ -0,0 +1,30 @@
+-- Avisa as telas da agenda (canal "agenda") a cada escrita em agendamentos, qualquer que seja a origem:
+-- rotas da agenda, séries, importação ou exclusão de paciente em cascata. Um NOTIFY por comando,
+-- com os ids afetados; comandos grandes mandam só "recarregar". O NOTIFY sai no COMMIT.
+CREATE OR REPLACE FUNCTION notificar_agenda_trg() RETURNS trigger AS $$
+DECLARE
+    ids INTEGER[];
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT array_agg(id) INTO ids FROM linhas_antigas;
+    ELSE
+        SELECT array_agg(id) INTO ids FROM linhas_novas;
+    END IF;
+    IF ids IS NULL THEN RETURN NULL; END IF;
+    IF cardinality(ids) > 500 THEN
+        PERFORM pg_notify('agenda', json_build_object('op', 'recarregar')::text);
+    ELSE
+        PERFORM pg_notify('agenda', json_build_object('op', CASE TG_OP WHEN 'DELETE' THEN 'remover' ELSE 'atualizar' END, 'ids', ids)::text);
+    END IF;
+    RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notificar_agenda_ins ON agendamentos;
+CREATE TRIGGER trg_notificar_agenda_ins AFTER INSERT ON agendamentos
+    REFERENCING NEW TABLE AS linhas_novas FOR EACH STATEMENT EXECUTE FUNCTION notificar_agenda_trg();
+DROP TRIGGER IF EXISTS trg_notificar_agenda_upd ON agendamentos;
+CREATE TRIGGER trg_notificar_agenda_upd AFTER UPDATE ON agendamentos
+    REFERENCING NEW TABLE AS linhas_novas FOR EACH STATEMENT EXECUTE FUNCTION notificar_agenda_trg();
+DROP TRIGGER IF EXISTS trg_notificar_agenda_del ON agendamentos;
+CREATE TRIGGER trg_notificar_agenda_del AFTER DELETE ON agendamentos
+    REFERENCING OLD TABLE AS linhas_antigas FOR EACH STATEMENT EXECUTE FUNCTION notificar_agenda_trg();
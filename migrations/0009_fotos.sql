@@ -0,0 +1,20 @@
+-- Fotos fora do banco: o arquivo fica no armazém (FOTOS_DIR), endereçado pelo SHA-256 do conteúdo;
+-- aqui só os metadados. As colunas base64 de avaliacao_postural continuam até o
+-- "flask migrar-fotos-legadas" esvaziá-las.
+CREATE TABLE IF NOT EXISTS fotos (
+    id SERIAL PRIMARY KEY,
+    paciente_id INTEGER NOT NULL REFERENCES pacientes(id) ON DELETE CASCADE,
+    avaliacao_postural_id INTEGER REFERENCES avaliacao_postural(id) ON DELETE SET NULL,
+    vista TEXT NOT NULL DEFAULT 'outra' CHECK (vista IN ('frontal', 'posterior', 'lat_dir', 'lat_esq', 'outra')),
+    data_foto TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+    chave TEXT NOT NULL,
+    tipo_mime TEXT NOT NULL,
+    tamanho INTEGER NOT NULL,
+    largura INTEGER,
+    altura INTEGER,
+    legenda TEXT,
+    criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+-- Linha do tempo do prontuário e contagem de referências ao apagar um arquivo
+CREATE INDEX IF NOT EXISTS idx_fotos_paciente_data ON fotos (paciente_id, data_foto DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_fotos_chave ON fotos (chave);
@@ -0,0 +1,10 @@
+-- migracao: sem-transacao
+-- Checagem de conflito na agenda: índice GiST na faixa de horário de cada sessão que ocupa a sala
+-- (não cancelada). O operador && (sobreposição) acha os conflitos em O(log n), e a disponibilidade
+-- usa o mesmo índice. Não é EXCLUDE: turmas de Pilates dividem horário de propósito (forcar=true).
+
+-- tsrange() recusa fim antes do início; corrige registros antigos antes de indexar
+UPDATE agendamentos SET end_time = start_time + INTERVAL '1 hour' WHERE end_time < start_time;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_agendamentos_faixa ON agendamentos USING gist (tsrange(start_time, end_time))
+    WHERE COALESCE(status, 'Agendado') <> 'Cancelado';
+ANALYZE agendamentos;
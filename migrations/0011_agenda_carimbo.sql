@@ -0,0 +1,26 @@
+-- Carimbo do feed incremental (?since=) com clock_timestamp(): NOW() é o início da transação, então uma
+-- transação longa gravava um atualizado_em já "no passado" do cursor que outro cliente acabou de receber.
+-- O trigger vale para toda escrita em agendamentos, venha da rota, da série, da importação ou do psql.
+CREATE OR REPLACE FUNCTION carimbar_agendamento_trg() RETURNS trigger AS $$
+BEGIN
+    NEW.atualizado_em := clock_timestamp();
+    RETURN NEW;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_carimbar_agendamento ON agendamentos;
+CREATE TRIGGER trg_carimbar_agendamento BEFORE INSERT OR UPDATE ON agendamentos
+    FOR EACH ROW EXECUTE FUNCTION carimbar_agendamento_trg();
+
+ALTER TABLE agendamentos_removidos ALTER COLUMN removido_em SET DEFAULT clock_timestamp();
+
+-- O evento mostra o nome do paciente: renomear toca os agendamentos dele, o que muda o ETag da janela,
+-- entra no feed ?since= e avisa as telas abertas pelo NOTIFY da 0008.
+CREATE OR REPLACE FUNCTION tocar_agenda_paciente_trg() RETURNS trigger AS $$
+BEGIN
+    UPDATE agendamentos SET atualizado_em = clock_timestamp() WHERE paciente_id = NEW.id;
+    RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tocar_agenda_paciente ON pacientes;
+CREATE TRIGGER trg_tocar_agenda_paciente AFTER UPDATE OF nome ON pacientes
+    FOR EACH ROW WHEN (OLD.nome IS DISTINCT FROM NEW.nome) EXECUTE FUNCTION tocar_agenda_paciente_trg();
@@ -0,0 +1,33 @@
+// Utilitários compartilhados pelas telas (carregado no <head> do layout, antes do conteúdo de cada página)
+
+// Texto vindo da API vai para innerHTML/atributos sempre escapado
+function esc(t) { return String(t ?? '').replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c])); }
+
+// Lista paginada por cursor (keyset): a API devolve os itens em d[chave] e o cursor em d.proximo (null no fim),
+// que volta como parâmetros na página seguinte. carregar(true) recomeça e cancela a página em andamento;
+// carregar() pede a próxima, uma de cada vez (botão "Carregar mais" ou sentinela no fim da lista).
+// mostrar(d, reiniciar) exibe uma página que veio por outro caminho (ex.: junto com o prontuário).
+function listaPaginada(o) {
+    let proximo = null, requisicao = null;
+    function cancelar() { if (requisicao) requisicao.abort(); requisicao = null; }
+    function exibir(d, reiniciar) {
+        const lista = document.getElementById(o.lista);
+        if (reiniciar) lista.innerHTML = '';
+        lista.insertAdjacentHTML('beforeend', d[o.chave].map(o.item).join(''));
+        proximo = d.proximo;
+        if (o.botao) document.getElementById(o.botao).classList.toggle('d-none', !proximo);
+        if (o.vazio) document.getElementById(o.vazio).classList.toggle('d-none', lista.children.length > 0);
+        if (o.depois) o.depois(lista, proximo);
+    }
+    function carregar(reiniciar) {
+        if (reiniciar) cancelar();
+        else if (requisicao || !proximo) return;
+        const controle = requisicao = new AbortController();
+        const params = new URLSearchParams({ ...(o.params ? o.params() : {}), ...(reiniciar ? {} : proximo) });
+        const url = typeof o.url === 'function' ? o.url() : o.url;
+        fetch(url + '?' + params, { signal: controle.signal }).then(r => r.json()).then(d => exibir(d, reiniciar))
+            .catch(e => { if (e.name !== 'AbortError') throw e; })
+            .finally(() => { if (requisicao === controle) requisicao = null; });
+    }
+    return { carregar, mostrar(d, reiniciar) { if (reiniciar) cancelar(); exibir(d, reiniciar); } };
+}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app.py fica na raiz do projeto, fora de pacote
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
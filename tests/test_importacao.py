@@ -0,0 +1,63 @@
+from datetime import date
+from decimal import Decimal
+
+import io
+
+import pytest
+
+from app import _cpf, _data_br, _ler_csv, _valor_br
+
+
+@pytest.mark.parametrize('entrada, esperado', [
+    ('1.234,56', Decimal('1234.56')),
+    ('R$ 1.234,56', Decimal('1234.56')),
+    ('1234,5', Decimal('1234.50')),
+    ('-1.000,00', Decimal('-1000.00')),
+    ('2.500', Decimal('2500.00')),
+    ('1.234', Decimal('1234.00')),
+    ('1.234.567', Decimal('1234567.00')),
+    ('150', Decimal('150.00')),
+    ('12.50', Decimal('12.50')),
+])
+def test_valor_br(entrada, esperado):
+    assert _valor_br(entrada) == esperado
+
+
+@pytest.mark.parametrize('entrada', ['12,345', '0,001', '12.3456', '1,5.0', '1.23.4', 'abc', 'NaN', '100000000'])
+def test_valor_br_rejeita_em_vez_de_arredondar(entrada):
+    with pytest.raises(ValueError):
+        _valor_br(entrada)
+
+
+def test_cpf_formata():
+    assert _cpf('52998224725') == '529.982.247-25'
+    assert _cpf('529.982.247-25') == '529.982.247-25'
+
+
+@pytest.mark.parametrize('entrada', ['529.982.247-26', '111.111.111-11', '1234567890', ''])
+def test_cpf_invalido(entrada):
+    with pytest.raises(ValueError):
+        _cpf(entrada)
+
+
+@pytest.mark.parametrize('entrada', ['05/03/2024', '2024-03-05', '05-03-2024', '05/03/24'])
+def test_data_br(entrada):
+    assert _data_br(entrada) == date(2024, 3, 5)
+
+
+@pytest.mark.parametrize('entrada', ['31/02/2024', '03/2024', 'ontem'])
+def test_data_br_invalida(entrada):
+    with pytest.raises(ValueError):
+        _data_br(entrada)
+
+
+@pytest.mark.parametrize('codificacao', ['utf-8', 'utf-8-sig', 'cp1252'])
+def test_ler_csv_excel_em_portugues(codificacao):
+    colunas, linhas = _ler_csv(io.BytesIO('nome;cidade\nJoão Conceição;São Paulo\n'.encode(codificacao)))
+    assert colunas == ['nome', 'cidade']
+    assert list(linhas) == [['João Conceição', 'São Paulo']]
+
+
+def test_ler_csv_codificacao_desconhecida():
+    with pytest.raises(ValueError):
+        _ler_csv(io.BytesIO(b'nome\n\x81\x8d\n'))